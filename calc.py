@@ -4,6 +4,15 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import random
+import hashlib
+import inspect
+import json
+import os
+import io
+import time
+import uuid
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 
 # -------------------------------------------------
@@ -128,7 +137,7 @@ def mostrar_tabla_comparativa(horas_estimadas, horas_reales):
 
 
 
-def generar_crecimiento_aleatorio(inicial, final, num_meses, ruido_factor=0.1, prob_perdida=0.15, max_perdida=0.05):
+def generar_crecimiento_aleatorio(inicial, final, num_meses, ruido_factor=0.1, prob_perdida=0.15, max_perdida=0.05, rng=None):
     """
     Genera una serie de valores con una tendencia global de crecimiento
     desde 'inicial' hasta 'final', pero con fluctuaciones realistas.
@@ -136,7 +145,10 @@ def generar_crecimiento_aleatorio(inicial, final, num_meses, ruido_factor=0.1, p
     - `ruido_factor`: Magnitud del ruido (fluctuaciones naturales).
     - `prob_perdida`: Probabilidad (0-1) de que un mes haya una caída en el número de fisios.
     - `max_perdida`: Máxima reducción posible en un mes si ocurre una caída.
+    - `rng`: Generador `random.Random` a usar (por defecto el estado global de `random`).
     """
+    rng = rng or random
+
     if num_meses <= 1:
         return [final] * num_meses
 
@@ -146,11 +158,11 @@ def generar_crecimiento_aleatorio(inicial, final, num_meses, ruido_factor=0.1, p
 
     for i in range(num_meses):
         # Factor aleatorio de ruido (pequeñas variaciones)
-        ruido = random.uniform(-ruido_factor, ruido_factor) * paso
+        ruido = rng.uniform(-ruido_factor, ruido_factor) * paso
         
         # Determinar si hay una caída de fisios este mes
-        if random.random() < prob_perdida:
-            perdida = random.uniform(0, max_perdida) * valor_actual  # Hasta un % del total actual
+        if rng.random() < prob_perdida:
+            perdida = rng.uniform(0, max_perdida) * valor_actual  # Hasta un % del total actual
             valor_actual -= perdida
         else:
             # Crecimiento con fluctuaciones
@@ -164,17 +176,24 @@ def generar_crecimiento_aleatorio(inicial, final, num_meses, ruido_factor=0.1, p
         valores.append(int(valor_actual))
     
     return valores
+# Tipo de cambio por defecto (EUR por 1 USD) para los costes facturados en dólares
+TIPO_CAMBIO_USD_EUR = 0.9
+
+
 def calcular_costes_almacenamiento_transferencia(
     num_videos, 
     num_clientes, 
     porcentaje_consumo, 
-    tipo_almacenamiento
+    tipo_almacenamiento,
+    tasa_conversion_usd_eur=TIPO_CAMBIO_USD_EUR
 ):
     """
     Calcula los costes de almacenamiento y transferencia según la fórmula especificada.
+
+    `tasa_conversion_usd_eur` puede ser un escalar o un array (p.ej. escenarios x meses);
+    en ese caso los costes se devuelven con la misma forma.
     """
     tamanio_video_gb = 0.14  # 140 MB -> 0.14 GB
-    tasa_conversion_usd_eur = 0.9
     
     # Tarifas GCP (USD -> EUR)
     tarifas_almacenamiento = {
@@ -199,6 +218,77 @@ def calcular_costes_almacenamiento_transferencia(
     coste_transferencia_anual = transferencia_anual_gb * tarifa_transferencia_gb
     
     return coste_alm_anual, coste_transferencia_anual, almacenamiento_total_gb, transferencia_anual_gb
+
+
+# Tarifas por uso (tramos graduales). Cada tarifa tiene una cuota fija mensual,
+# el límite inferior de cada tramo (en peticiones/mes), el precio por petición
+# dentro de ese tramo y la moneda en la que se factura. El primer tramo a 0
+# son las peticiones incluidas.
+TARIFAS_CHATBOT = {
+    "plan1": {  # 425.51€/mes con 20.000 conversaciones incluidas
+        "cuota": 425.51,
+        "limites": [0, 20000, 100000],
+        "precios": [0.0, 0.02, 0.015],
+        "moneda": "EUR"
+    },
+    "plan2": {  # 79 USD/mes con 2.000 conversaciones incluidas
+        "cuota": 79.0,
+        "limites": [0, 2000, 10000],
+        "precios": [0.0, 0.045, 0.035],
+        "moneda": "USD"
+    }
+}
+
+# Las APIs (DNI, mapa, SMS, videollamada) mantienen el coste anual contratado
+# (prorrateado al mes, en €) y se les suma el exceso por llamadas según estos tramos.
+TARIFA_APIS = {
+    "cuota": 0.0,
+    "limites": [0, 5000, 50000, 250000],
+    "precios": [0.0, 0.011, 0.009, 0.0055],
+    "moneda": "USD"
+}
+
+
+def convertir_a_eur(importe, moneda, tipo_cambio_usd_eur=TIPO_CAMBIO_USD_EUR):
+    """
+    Convierte un importe (escalar o array) a euros. Los importes en USD se
+    multiplican por el tipo de cambio, que puede ser un array que se difunde
+    sobre escenarios y meses.
+    """
+    if moneda == "USD":
+        return importe * tipo_cambio_usd_eur
+    return importe
+
+
+def coste_por_tramos(uso, tarifa):
+    """
+    Calcula el coste mensual de un servicio con precios por tramos graduales.
+
+    Funciona tanto con escalares como con arrays de cualquier forma
+    (p.ej. escenarios x meses): los tramos se localizan con `np.searchsorted`
+    sobre la tabla de límites, sin bucles en Python.
+
+    Args:
+        uso (float | np.ndarray): Peticiones consumidas en el mes.
+        tarifa (dict): Diccionario con "cuota", "limites" y "precios".
+
+    Returns:
+        float | np.ndarray: Cuota fija + coste de las peticiones de cada tramo.
+    """
+    limites = np.asarray(tarifa["limites"], dtype=float)
+    precios = np.asarray(tarifa["precios"], dtype=float)
+
+    # Coste acumulado al inicio de cada tramo (tramos completos anteriores)
+    coste_inicio_tramo = np.concatenate(([0.0], np.cumsum(np.diff(limites) * precios[:-1])))
+
+    uso = np.maximum(np.asarray(uso, dtype=float), 0.0)
+    tramo = np.searchsorted(limites, uso, side="right") - 1
+    tramo = np.clip(tramo, 0, len(limites) - 1)
+
+    coste = tarifa["cuota"] + coste_inicio_tramo[tramo] + precios[tramo] * (uso - limites[tramo])
+    return coste if coste.ndim else float(coste)
+
+
 def coste_operacion_mensual(
     mes_num,
     # Mantenimiento
@@ -216,7 +306,12 @@ def coste_operacion_mensual(
     tipo_almacenamiento,
     # NUEVOS PARÁMETROS PARA MARKETING
     marketing_horas=15,       # horas de marketing al mes (por defecto 15)
-    marketing_tarifa=25.0     # coste €/hora de marketing (por defecto 25)
+    marketing_tarifa=25.0,    # coste €/hora de marketing (por defecto 25)
+    # Uso de Chatbot y APIs (peticiones por cliente y mes)
+    peticiones_chatbot_cliente=0.0,
+    peticiones_apis_cliente=0.0,
+    # Tipo de cambio del mes (EUR por 1 USD)
+    tipo_cambio_usd_eur=TIPO_CAMBIO_USD_EUR
 ):
     """
     Calcula el coste de operación para un mes, dados los parámetros.
@@ -228,8 +323,8 @@ def coste_operacion_mensual(
         incidencias_iniciales (int): Incidencias estimadas en mes 1.
         decremento_incidencias (int): Cantidad en que se reducen las incidencias cada mes (hasta 1).
         modo_mantenimiento_adaptativo (str): "prorrateado" o "trimestral".
-        chatbot_plan (str): "plan1" (425.51€/mes) o "plan2" (~74€/mes).
-        coste_apis_mensual (float): Coste de APIs prorrateado al mes.
+        chatbot_plan (str): "plan1" (425.51€/mes) o "plan2" (~74€/mes), ver TARIFAS_CHATBOT.
+        coste_apis_mensual (float): Coste de APIs contratado, prorrateado al mes.
         fisios_actual (int): Número de fisioterapeutas en este mes.
         videos_por_fisio_promedio (float): Media de vídeos por fisio (ponderado básico/premium).
         clientes_actual (int): Clientes por fisio en este mes.
@@ -237,16 +332,27 @@ def coste_operacion_mensual(
         tipo_almacenamiento (str): 'Standard', 'Nearline', etc.
         marketing_horas (int): Horas dedicadas a marketing en este mes (por defecto 15).
         marketing_tarifa (float): Coste €/hora de marketing (por defecto 25).
+        peticiones_chatbot_cliente (float): Conversaciones con el chatbot por cliente y mes.
+        peticiones_apis_cliente (float): Llamadas a APIs por cliente y mes.
+        tipo_cambio_usd_eur (float): EUR por 1 USD para los costes facturados en dólares.
 
     Returns:
         dict: con el desglose de costes mensuales, incluyendo la nueva clave "Marketing".
     """
 
-    # 1) Coste del Chatbot
-    if chatbot_plan == "plan1":
-        coste_chatbot = 425.51
-    else:
-        coste_chatbot = 74.0  # ~79 USD -> ~74€
+    # 1) Coste del Chatbot y APIs según uso (clientes totales x peticiones por cliente)
+    clientes_totales = fisios_actual * clientes_actual
+    tarifa_chatbot = TARIFAS_CHATBOT[chatbot_plan]
+    coste_chatbot = convertir_a_eur(
+        coste_por_tramos(clientes_totales * peticiones_chatbot_cliente, tarifa_chatbot),
+        tarifa_chatbot["moneda"],
+        tipo_cambio_usd_eur
+    )
+    coste_apis = coste_apis_mensual + convertir_a_eur(
+        coste_por_tramos(clientes_totales * peticiones_apis_cliente, TARIFA_APIS),
+        TARIFA_APIS["moneda"],
+        tipo_cambio_usd_eur
+    )
 
     # 2) Mantenimiento Adaptativo
     # 2 jornadas x 8h x 27€/h => 432€ (trimestral) => 1728€/año => 144€/mes prorrateado
@@ -270,7 +376,8 @@ def coste_operacion_mensual(
         videos_por_fisio_promedio,
         clientes_actual,
         porcentaje_consumo,
-        tipo_almacenamiento
+        tipo_almacenamiento,
+        tipo_cambio_usd_eur
     )
 
     # Multiplicamos por fisios_actual y dividimos entre 12 para coste mensual total
@@ -289,7 +396,7 @@ def coste_operacion_mensual(
         coste_despliegue +
         coste_correctivo +
         coste_adaptativo +
-        coste_apis_mensual +
+        coste_apis +
         coste_alm_mensual +
         coste_trans_mensual +
         coste_marketing
@@ -305,12 +412,119 @@ def coste_operacion_mensual(
         "Despliegue": coste_despliegue,
         "Mantenimiento Correctivo": coste_correctivo,
         "Mantenimiento Adaptativo": coste_adaptativo,
-        "APIs": coste_apis_mensual,
+        "APIs": coste_apis,
         "Almacenamiento (GCP)": coste_alm_mensual,
         "Transferencia (GCP)": coste_trans_mensual,
         "Marketing": coste_marketing,           # <--- NUEVA CLAVE
-        "Total Mensual": total_mes
+        "Total Mensual": total_mes,
+        "Tipo de cambio USD/EUR": tipo_cambio_usd_eur
     }
+# -------------------------------------------------
+# PARÁMETROS VARIABLES EN EL TIEMPO (CALENDARIOS)
+# -------------------------------------------------
+# Los parámetros de uso y precio pueden cambiar a lo largo de la simulación
+# (subidas de precio, campañas de marketing, adopción progresiva del plan
+# premium...). Cada uno admite:
+# - un escalar (constante todos los meses),
+# - una lista/array con un valor por mes (si es más corta, se repite el último),
+# - {"tipo": "escalon", "inicial": v0, "cambios": {mes: valor, ...}}: el valor
+#   pasa a `valor` desde `mes` (incluido) en adelante,
+# - {"tipo": "rampa", "inicial": v0, "final": v1, "mes_inicio": a, "mes_fin": b}:
+#   v0 hasta el mes a, interpolación lineal hasta v1 en el mes b y v1 después.
+# Los calendarios se expanden a un array de forma (meses,) que se difunde sobre
+# todos los escenarios en el motor por lotes.
+PARAMETROS_CON_CALENDARIO = [
+    "basic_videos",
+    "premium_videos",
+    "porcentaje_premium",
+    "porcentaje_consumo",
+    "coste_apis_anual",
+    "marketing_horas",
+    "marketing_tarifa",
+    "peticiones_chatbot_cliente",
+    "peticiones_apis_cliente"
+]
+# Opciones discretas que pueden cambiar a lo largo del período: admiten un valor,
+# una serie o un calendario en escalón (una rampa entre opciones no tiene sentido).
+OPCIONES_CON_CALENDARIO = [
+    "tipo_almacenamiento",
+    "modo_mantenimiento_adaptativo",
+    "chatbot_plan"
+]
+
+
+def expandir_calendario(valor, num_meses):
+    """
+    Convierte un parámetro (escalar, serie o calendario) en un array float
+    con un valor por mes.
+    """
+    meses = np.arange(1, num_meses + 1)
+
+    if isinstance(valor, dict):
+        tipo = valor.get("tipo")
+        if tipo == "escalon":
+            serie = np.full(num_meses, float(valor["inicial"]))
+            for mes, nuevo_valor in sorted((int(m), v) for m, v in valor.get("cambios", {}).items()):
+                serie[meses >= mes] = nuevo_valor
+            return serie
+        if tipo == "rampa":
+            mes_inicio, mes_fin = int(valor["mes_inicio"]), int(valor["mes_fin"])
+            if mes_fin <= mes_inicio:
+                return np.where(meses >= mes_inicio, float(valor["final"]), float(valor["inicial"]))
+            return np.interp(meses, [mes_inicio, mes_fin], [float(valor["inicial"]), float(valor["final"])])
+        raise ValueError(f"Tipo de calendario desconocido: {tipo!r} (usa 'escalon' o 'rampa')")
+
+    serie = np.asarray(valor, dtype=float)
+    if serie.ndim == 0:
+        return np.full(num_meses, float(serie))
+    if serie.ndim != 1 or serie.size == 0:
+        raise ValueError("La serie de un parámetro debe ser una lista no vacía con un valor por mes")
+    if serie.size < num_meses:
+        serie = np.concatenate((serie, np.full(num_meses - serie.size, serie[-1])))
+    return serie[:num_meses]
+
+
+def expandir_calendario_opcion(valor, num_meses):
+    """
+    Convierte una opción discreta (valor, serie o calendario en escalón) en un
+    array de objetos con la opción de cada mes.
+    """
+    meses = np.arange(1, num_meses + 1)
+
+    if isinstance(valor, dict):
+        if valor.get("tipo") != "escalon":
+            raise ValueError(
+                f"Las opciones solo admiten calendarios en escalón, no {valor.get('tipo')!r}"
+            )
+        serie = np.full(num_meses, valor["inicial"], dtype=object)
+        for mes, nueva_opcion in sorted((int(m), v) for m, v in valor.get("cambios", {}).items()):
+            serie[meses >= mes] = nueva_opcion
+        return serie
+
+    if isinstance(valor, str):
+        return np.full(num_meses, valor, dtype=object)
+    serie = list(valor)
+    if not serie:
+        raise ValueError("La serie de una opción debe ser una lista no vacía con un valor por mes")
+    serie += [serie[-1]] * (num_meses - len(serie))
+    return np.array(serie[:num_meses], dtype=object)
+
+
+def expandir_parametros(parametros, num_meses):
+    """
+    Devuelve una copia de `parametros` con los de PARAMETROS_CON_CALENDARIO y
+    OPCIONES_CON_CALENDARIO expandidos a un array por mes. El resto se deja tal cual.
+    """
+    def expandir(nombre, valor):
+        if nombre in PARAMETROS_CON_CALENDARIO:
+            return expandir_calendario(valor, num_meses)
+        if nombre in OPCIONES_CON_CALENDARIO:
+            return expandir_calendario_opcion(valor, num_meses)
+        return valor
+
+    return {nombre: expandir(nombre, valor) for nombre, valor in parametros.items()}
+
+
 def calcular_costes_operacion_simulacion(
     fisios_inicial,
     fisios_final,
@@ -331,18 +545,56 @@ def calcular_costes_operacion_simulacion(
     # Simulación
     num_meses,
     # Factor de ruido
-    ruido_factor=0.1
+    ruido_factor=0.1,
+    # Uso de Chatbot y APIs
+    peticiones_chatbot_cliente=0.0,
+    peticiones_apis_cliente=0.0,
+    # Reproducibilidad
+    semilla=None,
+    # Tipo de cambio (escalar o una serie con un valor por mes)
+    tipo_cambio_usd_eur=TIPO_CAMBIO_USD_EUR,
+    # Marketing
+    marketing_horas=15,
+    marketing_tarifa=25.0
 ):
     """
     Simula los costes de operación mes a mes, usando un 'crecimiento' aleatorio 
     con tendencia, y diferenciando vídeos básicos/premium.
+
+    Si se indica `semilla`, las fluctuaciones se generan con un `random.Random`
+    propio y la misma semilla produce siempre el mismo desglose.
+
+    Los parámetros de PARAMETROS_CON_CALENDARIO y OPCIONES_CON_CALENDARIO
+    admiten un calendario por mes (ver `expandir_calendario` y
+    `expandir_calendario_opcion`).
     """
+    tipos_cambio = np.broadcast_to(np.asarray(tipo_cambio_usd_eur, dtype=float), (num_meses,))
+    calendarios = expandir_parametros(
+        dict(
+            basic_videos=basic_videos,
+            premium_videos=premium_videos,
+            porcentaje_premium=porcentaje_premium,
+            porcentaje_consumo=porcentaje_consumo,
+            tipo_almacenamiento=tipo_almacenamiento,
+            modo_mantenimiento_adaptativo=modo_mantenimiento_adaptativo,
+            chatbot_plan=chatbot_plan,
+            coste_apis_anual=coste_apis_anual,
+            marketing_horas=marketing_horas,
+            marketing_tarifa=marketing_tarifa,
+            peticiones_chatbot_cliente=peticiones_chatbot_cliente,
+            peticiones_apis_cliente=peticiones_apis_cliente
+        ),
+        num_meses
+    )
+
+    rng = random.Random(semilla) if semilla is not None else None
+
     # Generamos la secuencia de fisios y clientes con factor aleatorio
-    fisios_por_mes = generar_crecimiento_aleatorio(fisios_inicial, fisios_final, num_meses, ruido_factor)
-    clientes_por_mes = generar_crecimiento_aleatorio(clientes_inicial, clientes_final, num_meses, ruido_factor)
+    fisios_por_mes = generar_crecimiento_aleatorio(fisios_inicial, fisios_final, num_meses, ruido_factor, rng=rng)
+    clientes_por_mes = generar_crecimiento_aleatorio(clientes_inicial, clientes_final, num_meses, ruido_factor, rng=rng)
 
     # Coste de APIs prorrateado
-    coste_apis_mensual = coste_apis_anual / 12.0
+    costes_apis_mensuales = calendarios["coste_apis_anual"] / 12.0
 
     # Para cada mes, calculamos la media ponderada de vídeos/fisio
     filas = []
@@ -355,22 +607,30 @@ def calcular_costes_operacion_simulacion(
             videos_promedio = 0
         else:
             # # fisios premium
-            premium_f = fisios_act * (porcentaje_premium / 100.0)
+            premium_f = fisios_act * (float(calendarios["porcentaje_premium"][i]) / 100.0)
             basic_f = fisios_act - premium_f
-            videos_promedio = (premium_f * premium_videos + basic_f * basic_videos) / fisios_act
+            videos_promedio = (
+                premium_f * float(calendarios["premium_videos"][i]) +
+                basic_f * float(calendarios["basic_videos"][i])
+            ) / fisios_act
 
         fila_mes = coste_operacion_mensual(
             mes_num=mes_num,
             incidencias_iniciales=incidencias_iniciales,
             decremento_incidencias=decremento_incidencias,
-            modo_mantenimiento_adaptativo=modo_mantenimiento_adaptativo,
-            chatbot_plan=chatbot_plan,
-            coste_apis_mensual=coste_apis_mensual,
+            modo_mantenimiento_adaptativo=calendarios["modo_mantenimiento_adaptativo"][i],
+            chatbot_plan=calendarios["chatbot_plan"][i],
+            coste_apis_mensual=float(costes_apis_mensuales[i]),
             fisios_actual=fisios_act,
             videos_por_fisio_promedio=videos_promedio,
             clientes_actual=clientes_act,
-            porcentaje_consumo=porcentaje_consumo,
-            tipo_almacenamiento=tipo_almacenamiento
+            porcentaje_consumo=float(calendarios["porcentaje_consumo"][i]),
+            tipo_almacenamiento=calendarios["tipo_almacenamiento"][i],
+            marketing_horas=float(calendarios["marketing_horas"][i]),
+            marketing_tarifa=float(calendarios["marketing_tarifa"][i]),
+            peticiones_chatbot_cliente=float(calendarios["peticiones_chatbot_cliente"][i]),
+            peticiones_apis_cliente=float(calendarios["peticiones_apis_cliente"][i]),
+            tipo_cambio_usd_eur=float(tipos_cambio[i])
         )
         filas.append(fila_mes)
 
@@ -378,6 +638,1217 @@ def calcular_costes_operacion_simulacion(
     return df_resultado
 
 
+# -------------------------------------------------
+# REPRODUCIBILIDAD Y CACHÉ DE RESULTADOS
+# -------------------------------------------------
+# Cambiar la versión del motor invalida todas las huellas (y la caché) anteriores.
+# Debe incrementarse siempre que cambie el resultado numérico de la simulación.
+VERSION_MOTOR = "1.1.0"
+
+DIRECTORIO_CACHE = os.environ.get("FISIOFIND_CACHE_DIR", ".cache_simulaciones")
+TAMANIO_MAXIMO_CACHE = 256 * 1024 * 1024  # 256 MB
+
+
+def _normalizar_parametro(valor):
+    """
+    Convierte un parámetro a una forma canónica serializable en JSON, de modo que
+    entradas equivalentes (10 vs 10.0, np.int64 vs int, tuplas vs listas) den la misma huella.
+    """
+    if isinstance(valor, dict):
+        return {str(k): _normalizar_parametro(v) for k, v in sorted(valor.items())}
+    if isinstance(valor, (list, tuple, np.ndarray)):
+        return [_normalizar_parametro(v) for v in valor]
+    if isinstance(valor, (bool, np.bool_)):
+        return bool(valor)
+    if isinstance(valor, (int, float, np.integer, np.floating)):
+        valor = float(valor)
+        return int(valor) if valor.is_integer() else round(valor, 10)
+    if valor is None or isinstance(valor, str):
+        return valor
+    return str(valor)
+
+
+def calcular_huella(parametros, semilla):
+    """
+    Calcula la huella (SHA-256) de una ejecución: entradas normalizadas + semilla
+    + versión del motor. Dos ejecuciones con la misma huella dan el mismo resultado.
+    """
+    contenido = json.dumps(
+        {
+            "parametros": _normalizar_parametro(parametros),
+            "semilla": _normalizar_parametro(semilla),
+            "version_motor": VERSION_MOTOR
+        },
+        sort_keys=True,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+def _ruta_cache(huella):
+    return os.path.join(DIRECTORIO_CACHE, huella[:2], huella + ".pkl")
+
+
+def cargar_resultado_cache(huella):
+    """
+    Devuelve el resultado (DataFrame o lote) guardado para una huella, o None
+    si no está en caché. Una entrada ilegible (pickle truncado, clases de una
+    versión anterior, ...) cuenta como fallo de caché y se elimina.
+    """
+    ruta = _ruta_cache(huella)
+    try:
+        df = pd.read_pickle(ruta)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+        return None
+    # Marcamos el acceso para que la expulsión elimine primero lo menos usado
+    try:
+        os.utime(ruta)
+    except OSError:
+        pass
+    return df
+
+
+def guardar_resultado_cache(huella, resultado):
+    """
+    Guarda un resultado (DataFrame o lote) en la caché en disco (direccionada
+    por huella) y expulsa las entradas más antiguas si se supera
+    TAMANIO_MAXIMO_CACHE.
+    """
+    ruta = _ruta_cache(huella)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+
+    # Escritura atómica: otros procesos (y otras sesiones de Streamlit, que son
+    # hilos del mismo proceso) nunca ven un fichero a medio escribir
+    descriptor, ruta_tmp = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+    os.close(descriptor)
+    try:
+        pd.to_pickle(resultado, ruta_tmp)
+        os.replace(ruta_tmp, ruta)
+    except BaseException:
+        os.remove(ruta_tmp)
+        raise
+
+    limpiar_cache()
+
+
+def limpiar_cache(tamanio_maximo=None):
+    """
+    Elimina los resultados menos usados recientemente hasta que la caché
+    ocupe como mucho `tamanio_maximo` bytes (por defecto TAMANIO_MAXIMO_CACHE).
+    """
+    tamanio_maximo = TAMANIO_MAXIMO_CACHE if tamanio_maximo is None else tamanio_maximo
+
+    entradas = []
+    for raiz, _, ficheros in os.walk(DIRECTORIO_CACHE):
+        for nombre in ficheros:
+            if not nombre.endswith(".pkl"):
+                continue
+            ruta = os.path.join(raiz, nombre)
+            try:
+                info = os.stat(ruta)
+            except OSError:
+                continue
+            entradas.append((info.st_mtime, info.st_size, ruta))
+
+    tamanio_total = sum(tamanio for _, tamanio, _ in entradas)
+    for _, tamanio, ruta in sorted(entradas):
+        if tamanio_total <= tamanio_maximo:
+            break
+        try:
+            os.remove(ruta)
+        except OSError:
+            continue
+        tamanio_total -= tamanio
+
+
+def _argumentos_completos(funcion, parametros, excluir=("semilla",)):
+    """
+    Completa `parametros` con los valores por defecto de `funcion`, de modo que
+    omitir un argumento o pasar su valor por defecto dé la misma huella.
+    Se quitan los argumentos de `excluir` (la semilla va aparte).
+    """
+    argumentos = inspect.signature(funcion).bind_partial(**parametros)
+    argumentos.apply_defaults()
+    return {nombre: valor for nombre, valor in argumentos.arguments.items() if nombre not in excluir}
+
+
+def simular_operacion_reproducible(semilla, usar_cache=True, **parametros):
+    """
+    Ejecuta `calcular_costes_operacion_simulacion` con una semilla fija y
+    adjunta la huella al resultado (`df.attrs["huella"]`).
+
+    Si ya existe un resultado con la misma huella en la caché en disco se
+    devuelve directamente, sin volver a simular. Con `semilla=None` se sortea
+    una semilla nueva y el resultado no pasa por la caché (no se repetiría).
+    """
+    if semilla is None:
+        semilla = random.SystemRandom().randrange(2**31)
+        usar_cache = False
+
+    huella = calcular_huella(_argumentos_completos(calcular_costes_operacion_simulacion, parametros), semilla)
+
+    if usar_cache:
+        df_cache = cargar_resultado_cache(huella)
+        if df_cache is not None:
+            return df_cache
+
+    df_resultado = calcular_costes_operacion_simulacion(semilla=semilla, **parametros)
+    df_resultado.attrs["huella"] = huella
+    df_resultado.attrs["semilla"] = semilla
+    df_resultado.attrs["version_motor"] = VERSION_MOTOR
+    df_resultado.attrs["parametros"] = _normalizar_parametro(parametros)
+
+    if usar_cache:
+        guardar_resultado_cache(huella, df_resultado)
+    return df_resultado
+
+
+# -------------------------------------------------
+# SIMULACIÓN POR LOTES (MONTE CARLO)
+# -------------------------------------------------
+# Columnas del lote y su tipo. Los costes se guardan en float32 y los conteos en
+# int32 (52 bytes por escenario-mes frente a ~1 KB de un dict por mes).
+# Los nombres coinciden con los de `coste_operacion_mensual`.
+COLUMNAS_LOTE = {
+    "Fisios": np.int32,
+    "Clientes/fisio": np.int32,
+    "Videos/fisio (avg)": np.float32,
+    "Chatbot": np.float32,
+    "Despliegue": np.float32,
+    "Mantenimiento Correctivo": np.float32,
+    "Mantenimiento Adaptativo": np.float32,
+    "APIs": np.float32,
+    "Almacenamiento (GCP)": np.float32,
+    "Transferencia (GCP)": np.float32,
+    "Marketing": np.float32,
+    "Total Mensual": np.float32,
+    "Tipo de cambio USD/EUR": np.float32
+}
+
+
+class LoteOperacion:
+    """
+    Resultados de operación de muchos escenarios, guardados por columnas.
+
+    Cada columna es un array contiguo de forma (escenarios, meses), de modo que
+    `lote["Total Mensual"]` es una vista sin copia y `a_dataframe` construye un
+    DataFrame de pandas que comparte memoria con el lote.
+
+    `metadatos` guarda con qué se generó el lote (parámetros, semilla y modelo
+    de tipo de cambio), igual que `df.attrs` en una simulación individual.
+    """
+    __slots__ = ("columnas", "meses", "huella", "metadatos")
+
+    def __init__(self, num_escenarios, num_meses):
+        self.columnas = {
+            nombre: np.zeros((num_escenarios, num_meses), dtype=tipo)
+            for nombre, tipo in COLUMNAS_LOTE.items()
+        }
+        self.meses = np.arange(1, num_meses + 1, dtype=np.int32)
+        self.huella = None
+        self.metadatos = {}
+
+    @classmethod
+    def desde_columnas(cls, columnas, meses=None):
+        """
+        Crea un lote a partir de columnas ya existentes (p.ej. arrays
+        mapeados en memoria con `np.load(..., mmap_mode="r")`), sin copiarlas.
+        """
+        lote = cls.__new__(cls)
+        lote.columnas = dict(columnas)
+        num_meses = lote.columnas["Total Mensual"].shape[1]
+        lote.meses = np.arange(1, num_meses + 1, dtype=np.int32) if meses is None else meses
+        lote.huella = None
+        lote.metadatos = {}
+        return lote
+
+    @classmethod
+    def desde_dataframe(cls, df):
+        """
+        Convierte el desglose de una única simulación en un lote de 1 escenario.
+        """
+        lote = cls(1, len(df))
+        for nombre, col in lote.columnas.items():
+            if nombre in df.columns:
+                col[0] = df[nombre].to_numpy()
+        lote.huella = df.attrs.get("huella")
+        lote.metadatos = {
+            clave: df.attrs[clave]
+            for clave in ["parametros", "semilla", "modelo_tipo_cambio"]
+            if clave in df.attrs
+        }
+        return lote
+
+    def __getitem__(self, nombre):
+        if nombre == "Mes":
+            return self.meses
+        return self.columnas[nombre]
+
+    @property
+    def num_escenarios(self):
+        return self.columnas["Total Mensual"].shape[0]
+
+    @property
+    def num_meses(self):
+        return self.columnas["Total Mensual"].shape[1]
+
+    @property
+    def nbytes(self):
+        return sum(col.nbytes for col in self.columnas.values()) + self.meses.nbytes
+
+    def a_dataframe(self, escenario=0):
+        """
+        Devuelve el desglose mensual de un escenario con las mismas columnas que
+        `calcular_costes_operacion_simulacion`, sin copiar los datos.
+        """
+        datos = {"Mes": self.meses}
+        datos.update({nombre: col[escenario] for nombre, col in self.columnas.items()})
+        return pd.DataFrame(datos, copy=False)
+
+
+def generar_crecimiento_lote(inicial, final, num_meses, num_escenarios, ruido_factor=0.1, prob_perdida=0.15, max_perdida=0.05, rng=None):
+    """
+    Versión vectorizada de `generar_crecimiento_aleatorio`: genera
+    `num_escenarios` trayectorias a la vez con un `np.random.Generator`.
+
+    Returns:
+        np.ndarray: Array int32 de forma (num_escenarios, num_meses).
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+
+    if num_meses <= 1:
+        return np.full((num_escenarios, num_meses), final, dtype=np.int32)
+
+    valores = np.empty((num_escenarios, num_meses), dtype=np.int32)
+    valor_actual = np.full(num_escenarios, float(inicial))
+    paso = (final - inicial) / (num_meses - 1)
+
+    # El crecimiento depende del mes anterior: iteramos meses, vectorizando escenarios
+    for i in range(num_meses):
+        ruido = rng.uniform(-ruido_factor, ruido_factor, num_escenarios) * paso
+        hay_perdida = rng.random(num_escenarios) < prob_perdida
+        perdida = rng.uniform(0, max_perdida, num_escenarios) * valor_actual
+
+        valor_actual = np.where(hay_perdida, valor_actual - perdida, valor_actual + paso + ruido)
+        valor_actual = np.round(np.maximum(valor_actual, 0))
+        valores[:, i] = valor_actual
+
+    return valores
+
+
+def leer_serie_tipo_cambio(ruta):
+    """
+    Lee una serie mensual de tipos de cambio (EUR por 1 USD) de un CSV, usando
+    la columna "usd_eur" o, si no existe, la primera columna numérica.
+    """
+    df_historico = pd.read_csv(ruta)
+    columna = "usd_eur" if "usd_eur" in df_historico.columns else df_historico.select_dtypes("number").columns[0]
+    serie = df_historico[columna].dropna().to_numpy(dtype=float)
+    if len(serie) == 0:
+        raise ValueError(f"El fichero de tipos de cambio '{ruta}' no contiene datos.")
+    return serie
+
+
+def generar_tipo_cambio(
+    num_escenarios,
+    num_meses,
+    modo="fijo",
+    tipo_inicial=TIPO_CAMBIO_USD_EUR,
+    volatilidad_anual=0.08,
+    deriva_anual=0.0,
+    ruta=None,
+    serie=None,
+    rng=None
+):
+    """
+    Genera el tipo de cambio (EUR por 1 USD) de cada escenario y mes.
+
+    - "fijo": el mismo `tipo_inicial` en todos los meses.
+    - "historico": serie mensual dada en `serie` o leída de un CSV (`ruta`).
+      Si tiene menos meses que la simulación se repite el último valor.
+    - "estocastico": movimiento browniano geométrico que parte de `tipo_inicial`,
+      con deriva y volatilidad anuales, distinto para cada escenario.
+
+    Returns:
+        np.ndarray: Array broadcastable a (num_escenarios, num_meses). Los modos
+        "fijo" e "historico" devuelven una única fila (1, num_meses).
+    """
+    if modo == "fijo":
+        return np.full((1, num_meses), float(tipo_inicial))
+
+    if modo == "historico":
+        serie = leer_serie_tipo_cambio(ruta) if serie is None else np.asarray(serie, dtype=float)
+        serie = serie[:num_meses]
+        serie = np.concatenate((serie, np.full(num_meses - len(serie), serie[-1])))
+        return serie[np.newaxis, :]
+
+    if modo == "estocastico":
+        rng = rng if rng is not None else np.random.default_rng()
+        sigma = volatilidad_anual / np.sqrt(12)
+        mu = deriva_anual / 12 - 0.5 * sigma ** 2
+        choques = rng.normal(mu, sigma, (num_escenarios, num_meses))
+        choques[:, 0] = 0.0  # El primer mes parte del tipo actual
+        return tipo_inicial * np.exp(np.cumsum(choques, axis=1))
+
+    raise ValueError(f"Modo de tipo de cambio desconocido: '{modo}'")
+
+
+def _segun_opcion(opcion, calcular):
+    """
+    Evalúa `calcular(valor)` para una opción discreta. Si `opcion` es un array
+    con la opción de cada mes, se evalúa una vez por opción distinta y se
+    combina mes a mes (también elemento a elemento si devuelve una tupla).
+    """
+    if isinstance(opcion, str):
+        return calcular(opcion)
+    opcion = np.asarray(opcion)
+    valores = list(dict.fromkeys(opcion.tolist()))
+    if len(valores) == 1:
+        return calcular(valores[0])
+
+    condiciones = [opcion == valor for valor in valores]
+    resultados = [calcular(valor) for valor in valores]
+    if isinstance(resultados[0], tuple):
+        return tuple(
+            np.select(condiciones, [resultado[i] for resultado in resultados])
+            for i in range(len(resultados[0]))
+        )
+    return np.select(condiciones, resultados)
+
+
+def coste_operacion_lote(
+    fisios,
+    clientes,
+    # Vídeos
+    basic_videos,
+    premium_videos,
+    porcentaje_premium,
+    porcentaje_consumo,
+    tipo_almacenamiento,
+    # Mantenimiento
+    incidencias_iniciales,
+    decremento_incidencias,
+    modo_mantenimiento_adaptativo,
+    # Chatbot
+    chatbot_plan,
+    coste_apis_mensual,
+    marketing_horas=15,
+    marketing_tarifa=25.0,
+    peticiones_chatbot_cliente=0.0,
+    peticiones_apis_cliente=0.0,
+    tipo_cambio_usd_eur=TIPO_CAMBIO_USD_EUR
+):
+    """
+    Equivalente vectorizado de `coste_operacion_mensual` para arrays de
+    fisios y clientes de forma (escenarios, meses). `tipo_cambio_usd_eur` y
+    los parámetros de uso (vídeos, porcentajes, APIs, marketing, peticiones)
+    pueden ser escalares o arrays broadcastables a esa forma, p.ej. un
+    calendario de forma (meses,) común a todos los escenarios. Las opciones
+    discretas (almacenamiento, mantenimiento, plan de chatbot) pueden ser un
+    valor o un array con la opción de cada mes (`expandir_calendario_opcion`).
+
+    Returns:
+        dict: Columnas de coste (float64) de la misma forma que `fisios`.
+    """
+    fisios = np.asarray(fisios, dtype=float)
+    clientes = np.asarray(clientes, dtype=float)
+    meses = np.arange(1, fisios.shape[-1] + 1)
+
+    # Media ponderada de vídeos por fisio (0 si no hay fisios)
+    ratio_premium = porcentaje_premium / 100.0
+    videos_promedio = np.where(
+        fisios > 0,
+        ratio_premium * premium_videos + (1 - ratio_premium) * basic_videos,
+        0.0
+    )
+
+    # Chatbot y APIs por tramos de uso
+    clientes_totales = fisios * clientes
+    peticiones_chatbot = clientes_totales * peticiones_chatbot_cliente
+    coste_chatbot = _segun_opcion(
+        chatbot_plan,
+        lambda plan: convertir_a_eur(
+            coste_por_tramos(peticiones_chatbot, TARIFAS_CHATBOT[plan]),
+            TARIFAS_CHATBOT[plan]["moneda"],
+            tipo_cambio_usd_eur
+        )
+    )
+    coste_apis = coste_apis_mensual + convertir_a_eur(
+        coste_por_tramos(clientes_totales * peticiones_apis_cliente, TARIFA_APIS),
+        TARIFA_APIS["moneda"],
+        tipo_cambio_usd_eur
+    )
+
+    # Mantenimiento (depende solo del mes: se calcula una vez y se difunde)
+    coste_adaptativo = _segun_opcion(
+        modo_mantenimiento_adaptativo,
+        lambda modo: np.full(meses.shape, 1728 / 12.0) if modo == "prorrateado" else np.where(meses % 3 == 0, 432.0, 0.0)
+    )
+    coste_correctivo = np.maximum(1, incidencias_iniciales - (meses - 1) * decremento_incidencias) * 27.0
+
+    # Almacenamiento y transferencia (la fórmula ya admite arrays)
+    coste_alm_anual_1, coste_trans_anual_1, _, _ = _segun_opcion(
+        tipo_almacenamiento,
+        lambda tipo: calcular_costes_almacenamiento_transferencia(
+            videos_promedio,
+            clientes,
+            porcentaje_consumo,
+            tipo,
+            tipo_cambio_usd_eur
+        )
+    )
+    coste_alm_mensual = (coste_alm_anual_1 * fisios) / 12.0
+    coste_trans_mensual = (coste_trans_anual_1 * fisios) / 12.0
+
+    coste_despliegue = 60.0
+    coste_marketing = marketing_horas * marketing_tarifa
+
+    total_mes = (
+        coste_chatbot +
+        coste_despliegue +
+        coste_correctivo +
+        coste_adaptativo +
+        coste_apis +
+        coste_alm_mensual +
+        coste_trans_mensual +
+        coste_marketing
+    )
+
+    forma = fisios.shape
+    return {
+        "Videos/fisio (avg)": videos_promedio,
+        "Chatbot": coste_chatbot,
+        "Despliegue": np.broadcast_to(coste_despliegue, forma),
+        "Mantenimiento Correctivo": np.broadcast_to(coste_correctivo, forma),
+        "Mantenimiento Adaptativo": np.broadcast_to(coste_adaptativo, forma),
+        "APIs": coste_apis,
+        "Almacenamiento (GCP)": coste_alm_mensual,
+        "Transferencia (GCP)": coste_trans_mensual,
+        "Marketing": np.broadcast_to(coste_marketing, forma),
+        "Total Mensual": total_mes,
+        "Tipo de cambio USD/EUR": np.broadcast_to(tipo_cambio_usd_eur, forma)
+    }
+
+
+def simular_operacion_lote(
+    num_escenarios,
+    fisios_inicial,
+    fisios_final,
+    clientes_inicial,
+    clientes_final,
+    basic_videos,
+    premium_videos,
+    porcentaje_premium,
+    porcentaje_consumo,
+    tipo_almacenamiento,
+    # Mantenimiento
+    incidencias_iniciales,
+    decremento_incidencias,
+    modo_mantenimiento_adaptativo,
+    # Chatbot
+    chatbot_plan,
+    coste_apis_anual,
+    # Simulación
+    num_meses,
+    ruido_factor=0.1,
+    peticiones_chatbot_cliente=0.0,
+    peticiones_apis_cliente=0.0,
+    semilla=None,
+    tamanio_bloque=50000,
+    modelo_tipo_cambio=None,
+    marketing_horas=15,
+    marketing_tarifa=25.0
+):
+    """
+    Simula `num_escenarios` trayectorias de costes de operación a la vez y
+    devuelve un `LoteOperacion` compacto.
+
+    Los costes se calculan por bloques de `tamanio_bloque` escenarios para que
+    los intermedios en float64 no crezcan con el total de escenarios.
+    `modelo_tipo_cambio` es un dict con los argumentos de `generar_tipo_cambio`
+    (por defecto, tipo fijo TIPO_CAMBIO_USD_EUR). Los parámetros de
+    PARAMETROS_CON_CALENDARIO y OPCIONES_CON_CALENDARIO admiten un calendario
+    por mes, que se expande una sola vez y se difunde sobre todos los escenarios.
+    """
+    rng = np.random.default_rng(semilla)
+    calendarios = expandir_parametros(
+        dict(
+            basic_videos=basic_videos,
+            premium_videos=premium_videos,
+            porcentaje_premium=porcentaje_premium,
+            porcentaje_consumo=porcentaje_consumo,
+            tipo_almacenamiento=tipo_almacenamiento,
+            modo_mantenimiento_adaptativo=modo_mantenimiento_adaptativo,
+            chatbot_plan=chatbot_plan,
+            coste_apis_anual=coste_apis_anual,
+            marketing_horas=marketing_horas,
+            marketing_tarifa=marketing_tarifa,
+            peticiones_chatbot_cliente=peticiones_chatbot_cliente,
+            peticiones_apis_cliente=peticiones_apis_cliente
+        ),
+        num_meses
+    )
+    lote = LoteOperacion(num_escenarios, num_meses)
+
+    lote.columnas["Fisios"][:] = generar_crecimiento_lote(
+        fisios_inicial, fisios_final, num_meses, num_escenarios, ruido_factor, rng=rng
+    )
+    lote.columnas["Clientes/fisio"][:] = generar_crecimiento_lote(
+        clientes_inicial, clientes_final, num_meses, num_escenarios, ruido_factor, rng=rng
+    )
+    tipos_cambio = generar_tipo_cambio(num_escenarios, num_meses, rng=rng, **(modelo_tipo_cambio or {}))
+
+    for inicio in range(0, num_escenarios, tamanio_bloque):
+        bloque = slice(inicio, inicio + tamanio_bloque)
+        costes = coste_operacion_lote(
+            lote.columnas["Fisios"][bloque],
+            lote.columnas["Clientes/fisio"][bloque],
+            basic_videos=calendarios["basic_videos"],
+            premium_videos=calendarios["premium_videos"],
+            porcentaje_premium=calendarios["porcentaje_premium"],
+            porcentaje_consumo=calendarios["porcentaje_consumo"],
+            tipo_almacenamiento=calendarios["tipo_almacenamiento"],
+            incidencias_iniciales=incidencias_iniciales,
+            decremento_incidencias=decremento_incidencias,
+            modo_mantenimiento_adaptativo=calendarios["modo_mantenimiento_adaptativo"],
+            chatbot_plan=calendarios["chatbot_plan"],
+            coste_apis_mensual=calendarios["coste_apis_anual"] / 12.0,
+            marketing_horas=calendarios["marketing_horas"],
+            marketing_tarifa=calendarios["marketing_tarifa"],
+            peticiones_chatbot_cliente=calendarios["peticiones_chatbot_cliente"],
+            peticiones_apis_cliente=calendarios["peticiones_apis_cliente"],
+            tipo_cambio_usd_eur=tipos_cambio[bloque] if tipos_cambio.shape[0] > 1 else tipos_cambio
+        )
+        for nombre, valores in costes.items():
+            lote.columnas[nombre][bloque] = valores
+
+    return lote
+
+
+def simular_lote_reproducible(num_escenarios, semilla, usar_cache=True, **parametros):
+    """
+    Ejecuta `simular_operacion_lote` y asigna la huella al lote (`lote.huella`),
+    calculada con los parámetros completos, el número de escenarios, el modelo
+    de tipo de cambio, la semilla y la versión del motor.
+
+    Igual que `simular_operacion_reproducible`: una huella ya calculada se sirve
+    desde la caché en disco y con `semilla=None` se sortea una semilla nueva sin
+    pasar por la caché. Los lotes mayores que TAMANIO_MAXIMO_CACHE no se guardan.
+    """
+    if semilla is None:
+        semilla = random.SystemRandom().randrange(2**31)
+        usar_cache = False
+
+    argumentos = _argumentos_completos(
+        simular_operacion_lote,
+        dict(parametros, num_escenarios=num_escenarios),
+        excluir=("semilla", "tamanio_bloque")
+    )
+    huella = calcular_huella(argumentos, semilla)
+
+    if usar_cache:
+        lote_cache = cargar_resultado_cache(huella)
+        if lote_cache is not None:
+            return lote_cache
+
+    lote = simular_operacion_lote(num_escenarios, semilla=semilla, **parametros)
+    lote.huella = huella
+    lote.metadatos = {
+        "parametros": _normalizar_parametro({k: v for k, v in parametros.items() if k != "modelo_tipo_cambio"}),
+        "semilla": semilla,
+        "modelo_tipo_cambio": _normalizar_parametro(parametros.get("modelo_tipo_cambio"))
+    }
+
+    if usar_cache and lote.nbytes <= TAMANIO_MAXIMO_CACHE:
+        guardar_resultado_cache(huella, lote)
+    return lote
+
+
+# -------------------------------------------------
+# MÉTRICAS FINANCIERAS (VAN, TIR, PAYBACK DESCONTADO)
+# -------------------------------------------------
+# Los flujos son mensuales: el índice 0 es la inversión inicial y el índice m
+# el flujo neto del mes m. Todas las funciones aceptan un único escenario
+# (forma (meses + 1,)) o muchos a la vez (forma (escenarios, meses + 1)).
+TASAS_DESCUENTO = [0.05, 0.08, 0.10, 0.12, 0.15]  # Anuales
+
+
+def calcular_flujos_caja(ingresos, costes, inversion_inicial):
+    """
+    Construye los flujos de caja mensuales: -inversión en t=0 y
+    ingresos - costes en cada mes.
+    """
+    neto = np.asarray(ingresos, dtype=float) - np.asarray(costes, dtype=float)
+    inversion = np.broadcast_to(-np.asarray(inversion_inicial, dtype=float), neto.shape[:-1] + (1,))
+    return np.concatenate((inversion, neto), axis=-1)
+
+
+def _factores_descuento(tasas_anuales, num_periodos):
+    """
+    Factores de descuento mensuales (1 + r)^(-t/12) de forma (tasas, periodos).
+    """
+    tasas = np.atleast_1d(np.asarray(tasas_anuales, dtype=float))
+    t = np.arange(num_periodos)
+    return (1.0 + tasas[:, np.newaxis]) ** (-t / 12.0)
+
+
+def calcular_van(flujos, tasas_anuales=TASAS_DESCUENTO):
+    """
+    Valor Actual Neto para cada escenario y tasa de descuento anual.
+
+    Returns:
+        np.ndarray: Forma (escenarios, tasas) (o (tasas,) para un escenario).
+    """
+    flujos = np.asarray(flujos, dtype=float)
+    return flujos @ _factores_descuento(tasas_anuales, flujos.shape[-1]).T
+
+
+def calcular_tir(flujos, tasa_min=-0.9, tasa_max=1.0, tolerancia=1e-9, max_iteraciones=100, max_ampliaciones=20):
+    """
+    Tasa Interna de Retorno anual de cada escenario.
+
+    Resuelve VAN(r) = 0 sobre la tasa mensual para todos los escenarios a la vez:
+    paso de Newton cuando cae dentro del intervalo que encierra la raíz y
+    bisección en caso contrario, de modo que siempre converge.
+
+    Cuando r crece el VAN tiende al flujo inicial; si en `tasa_max` aún tiene el
+    signo contrario, la raíz está por encima y se amplía el intervalo duplicando
+    1 + tasa_max (como mucho `max_ampliaciones` veces).
+
+    Returns:
+        np.ndarray: TIR anual por escenario; NaN si el VAN no cambia de signo
+        en el intervalo (mensual), p.ej. si nunca se recupera la inversión.
+    """
+    un_escenario = np.ndim(flujos) == 1
+    flujos = np.atleast_2d(np.asarray(flujos, dtype=float))
+    t = np.arange(flujos.shape[-1])
+
+    def van_y_derivada(r, filas=slice(None)):
+        descuento = (1.0 + r[:, np.newaxis]) ** (-t)
+        van = np.sum(flujos[filas] * descuento, axis=1)
+        derivada = np.sum(-t * flujos[filas] * descuento, axis=1) / (1.0 + r)
+        return van, derivada
+
+    bajo = np.full(len(flujos), tasa_min)
+    alto = np.full(len(flujos), tasa_max)
+    van_bajo, _ = van_y_derivada(bajo)
+    van_alto, _ = van_y_derivada(alto)
+    for _ in range(max_ampliaciones):
+        ampliar = (flujos[:, 0] != 0) & (np.sign(van_alto) == -np.sign(flujos[:, 0]))
+        ampliar &= np.sign(van_bajo) == np.sign(van_alto)
+        if not ampliar.any():
+            break
+        alto[ampliar] = 2.0 * alto[ampliar] + 1.0
+        van_alto[ampliar], _ = van_y_derivada(alto[ampliar], ampliar)
+    con_raiz = np.sign(van_bajo) != np.sign(van_alto)
+
+    escala = np.maximum(np.abs(flujos).sum(axis=1), 1.0)
+    r = (bajo + alto) / 2.0
+    activos = np.flatnonzero(con_raiz)
+    for _ in range(max_iteraciones):
+        if len(activos) == 0:
+            break
+        r_a, bajo_a, alto_a = r[activos], bajo[activos], alto[activos]
+        van, derivada = van_y_derivada(r_a, activos)
+
+        # Los escenarios ya resueltos dejan de iterar
+        pendiente = (np.abs(van) > tolerancia * escala[activos]) & (alto_a - bajo_a > tolerancia)
+
+        # Acotamos la raíz con el signo del VAN actual
+        mismo_signo_que_bajo = np.sign(van) == np.sign(van_bajo[activos])
+        bajo_a = np.where(mismo_signo_que_bajo, r_a, bajo_a)
+        alto_a = np.where(mismo_signo_que_bajo, alto_a, r_a)
+        van_bajo[activos] = np.where(mismo_signo_que_bajo, van, van_bajo[activos])
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r_newton = r_a - van / derivada
+        fuera = ~np.isfinite(r_newton) | (r_newton <= bajo_a) | (r_newton >= alto_a)
+        r_nuevo = np.where(fuera, (bajo_a + alto_a) / 2.0, r_newton)
+
+        r[activos] = np.where(pendiente, r_nuevo, r_a)
+        bajo[activos], alto[activos] = bajo_a, alto_a
+        activos = activos[pendiente]
+
+    tir = (1.0 + r) ** 12 - 1.0
+    tir = np.where(con_raiz, tir, np.nan)
+    return float(tir[0]) if un_escenario else tir
+
+
+def calcular_payback_descontado(flujos, tasa_anual):
+    """
+    Primer mes en el que el flujo acumulado descontado es >= 0.
+
+    Returns:
+        np.ndarray: Mes de recuperación por escenario (float), NaN si no se
+        recupera la inversión dentro del horizonte simulado.
+    """
+    un_escenario = np.ndim(flujos) == 1
+    flujos = np.atleast_2d(np.asarray(flujos, dtype=float))
+    acumulado = np.cumsum(flujos * _factores_descuento(tasa_anual, flujos.shape[-1])[0], axis=1)
+    recuperado = acumulado[:, 1:] >= 0
+    mes = np.where(recuperado.any(axis=1), np.argmax(recuperado, axis=1) + 1.0, np.nan)
+    return float(mes[0]) if un_escenario else mes
+
+
+def resumen_metricas_financieras(flujos, tasas_anuales=TASAS_DESCUENTO, tasa_payback=0.10, percentiles=(5, 50, 95)):
+    """
+    Resume la distribución de VAN (por tasa), TIR y payback descontado de
+    muchos escenarios en una tabla de percentiles.
+    """
+    flujos = np.atleast_2d(flujos)
+    van = calcular_van(flujos, tasas_anuales)
+    tir = calcular_tir(flujos)
+    payback = calcular_payback_descontado(flujos, tasa_payback)
+
+    def percentiles_validos(valores):
+        # Escenarios sin TIR o sin recuperación (NaN) no cuentan en los percentiles
+        if not np.isfinite(valores).any():
+            return [np.nan] * len(percentiles)
+        return np.nanpercentile(valores, percentiles)
+
+    filas = {}
+    for i, tasa in enumerate(np.atleast_1d(tasas_anuales)):
+        filas[f"VAN al {tasa:.0%}"] = np.percentile(van[:, i], percentiles)
+    filas["TIR anual"] = percentiles_validos(tir)
+    filas[f"Payback descontado al {tasa_payback:.0%} (mes)"] = percentiles_validos(payback)
+
+    df_resumen = pd.DataFrame(filas, index=[f"P{p}" for p in percentiles]).T
+    df_resumen["% escenarios con valor"] = [100.0] * len(np.atleast_1d(tasas_anuales)) + [
+        np.isfinite(tir).mean() * 100,
+        np.isfinite(payback).mean() * 100
+    ]
+    return df_resumen
+
+
+# -------------------------------------------------
+# OPTIMIZACIÓN DE LA CONFIGURACIÓN
+# -------------------------------------------------
+# Opciones discretas que explora el optimizador
+OPCIONES_ALMACENAMIENTO = ["Standard", "Nearline", "Coldline", "Archive"]
+OPCIONES_CHATBOT = ["plan1", "plan2"]
+OPCIONES_MANTENIMIENTO = ["prorrateado", "trimestral"]
+
+COLUMNAS_CONFIGURACION = [
+    "tipo_almacenamiento", "chatbot_plan", "modo_mantenimiento_adaptativo",
+    "precio_standard", "precio_premium"
+]
+# Precios con los que se alcanzan los fisios de la trayectoria base y el % de
+# fisios premium de la pestaña de operación
+PRECIO_STANDARD_REFERENCIA = 17.99
+PRECIO_PREMIUM_REFERENCIA = 24.99
+# Fracción del mercado potencial que capta la trayectoria base a esos precios:
+# bajando precios como mucho se llega a fisios / CUOTA_MERCADO_REFERENCIA
+CUOTA_MERCADO_REFERENCIA = 0.5
+# Límite de duración de una optimización lanzada desde la interfaz y ritmo
+# conservador (celdas candidato x escenario x mes por segundo) para estimarla
+MAX_SEGUNDOS_OPTIMIZACION = 60
+CELDAS_POR_SEGUNDO_OPTIMIZACION = 1e7
+
+
+def cuota_logistica(x, x_referencia, cuota_referencia, elasticidad):
+    """
+    Cuota logística decreciente en `x` que vale `cuota_referencia` en
+    `x_referencia` y tiene ahí elasticidad `-elasticidad`.
+
+    A diferencia de una demanda de elasticidad constante, la cuota satura en 1
+    cuando `x` baja y cae exponencialmente cuando sube, de modo que el ingreso
+    x * cuota(x) tiene un máximo interior para cualquier elasticidad > 0.
+    """
+    cuota_referencia = np.clip(cuota_referencia, 0.01, 0.99)
+    pendiente = elasticidad / (np.maximum(x_referencia, 0.01) * (1 - cuota_referencia))
+    exponente = np.minimum(pendiente * (x - x_referencia), 700.0)
+    return 1.0 / (1.0 + (1 - cuota_referencia) / cuota_referencia * np.exp(exponente))
+
+
+def respuesta_demanda(
+    precio_standard,
+    precio_premium,
+    porcentaje_premium_referencia,
+    elasticidad_precio,
+    elasticidad_premium,
+    precios_referencia=(PRECIO_STANDARD_REFERENCIA, PRECIO_PREMIUM_REFERENCIA),
+    cuota_mercado=CUOTA_MERCADO_REFERENCIA
+):
+    """
+    Respuesta de los fisios a unos precios (escalares o arrays broadcastables).
+
+    - El % de fisios premium depende de la diferencia de precio premium -
+      standard: logística anclada en `porcentaje_premium_referencia` a la
+      diferencia de los precios de referencia.
+    - El número de fisios depende del precio medio resultante: logística
+      anclada en `cuota_mercado` al precio medio de referencia, con techo en
+      fisios / `cuota_mercado`.
+
+    Returns:
+        tuple: (factor sobre los fisios de la trayectoria base, % premium,
+        precio medio por fisio).
+    """
+    standard_referencia, premium_referencia = precios_referencia
+    ratio_referencia = np.clip(np.asarray(porcentaje_premium_referencia, dtype=float) / 100.0, 0.01, 0.99)
+
+    ratio_premium = cuota_logistica(
+        precio_premium - precio_standard,
+        premium_referencia - standard_referencia,
+        ratio_referencia,
+        elasticidad_premium
+    )
+    precio_medio = precio_standard * (1 - ratio_premium) + precio_premium * ratio_premium
+    precio_medio_referencia = standard_referencia * (1 - ratio_referencia) + premium_referencia * ratio_referencia
+
+    factor_fisios = cuota_logistica(
+        precio_medio, precio_medio_referencia, cuota_mercado, elasticidad_precio
+    ) / cuota_mercado
+    return factor_fisios, ratio_premium * 100.0, precio_medio
+
+
+def generar_candidatos(
+    rango_precio_standard=(10.0, 30.0),
+    rango_precio_premium=(15.0, 40.0),
+    pasos_precio=6
+):
+    """
+    Genera la rejilla de configuraciones candidatas: todas las combinaciones de
+    opciones discretas por una rejilla de precios. Solo se conservan las
+    combinaciones con precio premium >= precio standard. El % de fisios
+    premium no es una decisión: lo determinan los precios (`respuesta_demanda`).
+    """
+    indice = pd.MultiIndex.from_product(
+        [
+            OPCIONES_ALMACENAMIENTO,
+            OPCIONES_CHATBOT,
+            OPCIONES_MANTENIMIENTO,
+            np.round(np.linspace(*rango_precio_standard, pasos_precio), 2),
+            np.round(np.linspace(*rango_precio_premium, pasos_precio), 2)
+        ],
+        names=COLUMNAS_CONFIGURACION
+    )
+    candidatos = indice.to_frame(index=False)
+    return candidatos[candidatos["precio_premium"] >= candidatos["precio_standard"]].reset_index(drop=True)
+
+
+def _evaluar_candidatos(
+    candidatos,
+    fisios,
+    clientes,
+    tipos_cambio,
+    parametros_base,
+    coste_desarrollo,
+    objetivo,
+    tasa_descuento,
+    mes_equilibrio,
+    modelo_demanda,
+    max_elementos=2000000
+):
+    """
+    Valor del objetivo y VAN de cada candidato en cada escenario, ambos con
+    forma (candidatos, escenarios). El VAN sirve para desempatar candidatos
+    con el mismo objetivo (p.ej. probabilidad de equilibrio 1).
+
+    Todos los candidatos usan las mismas trayectorias de fisios, clientes y tipo
+    de cambio (números aleatorios comunes). Los candidatos que comparten opciones
+    discretas se evalúan juntos en un único array (precios, escenarios, meses).
+    `modelo_demanda` son los argumentos de `respuesta_demanda` salvo precios y
+    % premium de referencia.
+    """
+    num_escenarios, num_meses = fisios.shape
+    valores = np.empty((len(candidatos), num_escenarios))
+    van = np.empty((len(candidatos), num_escenarios))
+    columnas_grupo = COLUMNAS_CONFIGURACION[:3]
+    candidatos_por_bloque = max(1, max_elementos // (num_escenarios * num_meses))
+
+    for claves, grupo in candidatos.groupby(columnas_grupo, sort=False):
+        configuracion = dict(zip(columnas_grupo, claves))
+
+        for inicio in range(0, len(grupo), candidatos_por_bloque):
+            bloque = grupo.iloc[inicio:inicio + candidatos_por_bloque]
+            # Forma (precios, 1, meses): el % premium de referencia puede ser un calendario
+            factor_fisios, porcentaje_premium, precio_medio = respuesta_demanda(
+                bloque["precio_standard"].to_numpy()[:, np.newaxis, np.newaxis],
+                bloque["precio_premium"].to_numpy()[:, np.newaxis, np.newaxis],
+                parametros_base["porcentaje_premium"],
+                **modelo_demanda
+            )
+            fisios_candidato = fisios[np.newaxis] * factor_fisios
+
+            costes = coste_operacion_lote(
+                fisios_candidato,
+                clientes[np.newaxis],
+                basic_videos=parametros_base["basic_videos"],
+                premium_videos=parametros_base["premium_videos"],
+                porcentaje_premium=porcentaje_premium,
+                porcentaje_consumo=parametros_base["porcentaje_consumo"],
+                tipo_almacenamiento=configuracion["tipo_almacenamiento"],
+                incidencias_iniciales=parametros_base["incidencias_iniciales"],
+                decremento_incidencias=parametros_base["decremento_incidencias"],
+                modo_mantenimiento_adaptativo=configuracion["modo_mantenimiento_adaptativo"],
+                chatbot_plan=configuracion["chatbot_plan"],
+                coste_apis_mensual=parametros_base["coste_apis_anual"] / 12.0,
+                marketing_horas=parametros_base.get("marketing_horas", 15),
+                marketing_tarifa=parametros_base.get("marketing_tarifa", 25.0),
+                peticiones_chatbot_cliente=parametros_base.get("peticiones_chatbot_cliente", 0.0),
+                peticiones_apis_cliente=parametros_base.get("peticiones_apis_cliente", 0.0),
+                tipo_cambio_usd_eur=tipos_cambio[np.newaxis]
+            )["Total Mensual"]
+            ingresos = fisios_candidato * precio_medio
+
+            filas = grupo.index[inicio:inicio + len(bloque)]
+            flujos = calcular_flujos_caja(ingresos, costes, coste_desarrollo)
+            van[filas] = calcular_van(flujos, [tasa_descuento])[..., 0]
+            if objetivo == "van":
+                valores[filas] = van[filas]
+            else:
+                roi = np.cumsum(ingresos - costes, axis=-1)[..., :mes_equilibrio] - coste_desarrollo
+                valores[filas] = (roi >= 0).any(axis=-1)
+
+    return valores, van
+
+
+def optimizar_configuracion(
+    parametros_base,
+    coste_desarrollo,
+    objetivo="van",
+    tasa_descuento=0.10,
+    mes_equilibrio=None,
+    candidatos=None,
+    elasticidad_precio=1.2,
+    elasticidad_premium=1.0,
+    precios_referencia=(PRECIO_STANDARD_REFERENCIA, PRECIO_PREMIUM_REFERENCIA),
+    cuota_mercado=CUOTA_MERCADO_REFERENCIA,
+    escenarios_iniciales=200,
+    escenarios_maximos=3200,
+    nivel_confianza_z=2.0,
+    semilla=None,
+    modelo_tipo_cambio=None
+):
+    """
+    Busca la configuración de operación y precios que maximiza el objetivo bajo
+    incertidumbre Monte Carlo. Los fisios y su % premium responden a los precios
+    según `respuesta_demanda`, cuya demanda satura: el óptimo de precios puede
+    quedar en el interior de la rejilla.
+
+    Objetivos:
+    - "van": VAN esperado a `tasa_descuento`.
+    - "equilibrio": probabilidad de alcanzar ROI >= 0 como muy tarde en
+      `mes_equilibrio` (por defecto, el último mes).
+
+    Se usa "successive halving" con números aleatorios comunes: todos los
+    candidatos se evalúan sobre los mismos `escenarios_iniciales` escenarios;
+    se descartan los dominados (su cota superior de confianza queda por debajo
+    de la cota inferior del mejor) y, como mucho, se conserva la mitad. Los
+    supervivientes se reevalúan con el doble de escenarios hasta llegar a
+    `escenarios_maximos` o quedar uno solo.
+
+    Args:
+        parametros_base (dict): Parámetros de `simular_operacion_lote` (salvo
+            num_escenarios y semilla), calendarios incluidos. Las opciones
+            optimizadas se ignoran y los precios candidatos son constantes en
+            todo el horizonte; el % premium es el de referencia de la demanda.
+        coste_desarrollo (float): Inversión inicial en €.
+        candidatos (pd.DataFrame): Configuraciones a evaluar (por defecto
+            `generar_candidatos()`).
+        elasticidad_precio (float): Elasticidad de la demanda de fisios al
+            precio medio en el punto de referencia. Con 0 los precios altos
+            siempre son mejores.
+        elasticidad_premium (float): Elasticidad del % premium a la diferencia
+            de precio premium - standard.
+        precios_referencia (tuple): Precios standard y premium con los que se
+            alcanzan los fisios de la trayectoria base.
+        cuota_mercado (float): Fracción del mercado potencial captada a los
+            precios de referencia.
+
+    Returns:
+        pd.DataFrame: Candidatos ordenados de mejor a peor con el % premium y
+        la demanda relativa que inducen sus precios, el objetivo estimado, su
+        error estándar, el VAN esperado (desempate) y los escenarios con los
+        que se evaluó.
+    """
+    candidatos = generar_candidatos() if candidatos is None else candidatos.reset_index(drop=True)
+    num_meses = parametros_base["num_meses"]
+    parametros_base = expandir_parametros(parametros_base, num_meses)
+    mes_equilibrio = mes_equilibrio or num_meses
+
+    # Trayectorias comunes a todos los candidatos (se usan prefijos crecientes)
+    rng = np.random.default_rng(semilla)
+    fisios = generar_crecimiento_lote(
+        parametros_base["fisios_inicial"], parametros_base["fisios_final"],
+        num_meses, escenarios_maximos, parametros_base.get("ruido_factor", 0.1), rng=rng
+    ).astype(float)
+    clientes = generar_crecimiento_lote(
+        parametros_base["clientes_inicial"], parametros_base["clientes_final"],
+        num_meses, escenarios_maximos, parametros_base.get("ruido_factor", 0.1), rng=rng
+    ).astype(float)
+    tipos_cambio = np.broadcast_to(
+        generar_tipo_cambio(escenarios_maximos, num_meses, rng=rng, **(modelo_tipo_cambio or {})),
+        (escenarios_maximos, num_meses)
+    )
+
+    modelo_demanda = dict(
+        elasticidad_precio=elasticidad_precio,
+        elasticidad_premium=elasticidad_premium,
+        precios_referencia=precios_referencia,
+        cuota_mercado=cuota_mercado
+    )
+
+    ranking = candidatos.copy()
+    factor_fisios, porcentaje_premium, _ = respuesta_demanda(
+        ranking["precio_standard"].to_numpy()[:, np.newaxis],
+        ranking["precio_premium"].to_numpy()[:, np.newaxis],
+        parametros_base["porcentaje_premium"],
+        **modelo_demanda
+    )
+    ranking["porcentaje_premium"] = np.broadcast_to(porcentaje_premium, (len(ranking), num_meses)).mean(axis=1).round(1)
+    ranking["demanda_relativa"] = np.broadcast_to(factor_fisios, (len(ranking), num_meses)).mean(axis=1).round(3)
+    ranking["objetivo"] = np.nan
+    ranking["error_estandar"] = np.nan
+    ranking["van_esperado"] = np.nan
+    ranking["escenarios"] = 0
+
+    vivos = ranking.index.to_numpy()
+    num_escenarios = min(escenarios_iniciales, escenarios_maximos)
+    while True:
+        valores, van = _evaluar_candidatos(
+            candidatos.loc[vivos].reset_index(drop=True),
+            fisios[:num_escenarios],
+            clientes[:num_escenarios],
+            tipos_cambio[:num_escenarios],
+            parametros_base,
+            coste_desarrollo,
+            objetivo,
+            tasa_descuento,
+            mes_equilibrio,
+            modelo_demanda
+        )
+        media = valores.mean(axis=1)
+        error = valores.std(axis=1, ddof=1) / np.sqrt(num_escenarios) if num_escenarios > 1 else np.zeros(len(vivos))
+        ranking.loc[vivos, "objetivo"] = media
+        ranking.loc[vivos, "error_estandar"] = error
+        ranking.loc[vivos, "van_esperado"] = van.mean(axis=1)
+        ranking.loc[vivos, "escenarios"] = num_escenarios
+
+        if num_escenarios >= escenarios_maximos or len(vivos) <= 1:
+            break
+
+        # Poda: fuera los dominados y, como mucho, nos quedamos con la mitad.
+        # A igual objetivo se prefiere el de mayor VAN esperado
+        mejor_cota_inferior = np.max(media - nivel_confianza_z * error)
+        no_dominados = media + nivel_confianza_z * error >= mejor_cota_inferior
+        orden = np.lexsort((-van.mean(axis=1), -media))
+        orden = orden[no_dominados[orden]][:max(1, len(vivos) // 2)]
+        vivos = vivos[orden]
+        num_escenarios = min(num_escenarios * 2, escenarios_maximos)
+
+    return ranking.sort_values(
+        ["escenarios", "objetivo", "van_esperado"], ascending=False
+    ).reset_index(drop=True)
+
+
+def estimar_celdas_optimizacion(num_candidatos, num_meses, escenarios_iniciales=200, escenarios_maximos=3200):
+    """
+    Celdas candidato x escenario x mes que evalúa `optimizar_configuracion` en
+    el peor caso: ningún candidato dominado, solo se descarta la mitad en cada
+    ronda. Dividido entre `CELDAS_POR_SEGUNDO_OPTIMIZACION` da una cota del
+    tiempo de cálculo.
+    """
+    celdas = 0
+    vivos = num_candidatos
+    num_escenarios = min(escenarios_iniciales, escenarios_maximos)
+    while True:
+        celdas += vivos * num_escenarios * num_meses
+        if num_escenarios >= escenarios_maximos or vivos <= 1:
+            return celdas
+        vivos = max(1, vivos // 2)
+        num_escenarios = min(num_escenarios * 2, escenarios_maximos)
+
+
+def valores_en_limite(configuracion, candidatos):
+    """
+    Columnas numéricas de `configuracion` cuyo valor es el mínimo o el máximo
+    de la rejilla de `candidatos`. Un óptimo en el borde suele indicar que el
+    rango es demasiado estrecho.
+
+    Returns:
+        dict: {columna: "mínimo" | "máximo"}.
+    """
+    limites = {}
+    for columna in ["precio_standard", "precio_premium"]:
+        valores = candidatos[columna]
+        if valores.nunique() < 2:
+            continue
+        if configuracion[columna] == valores.min():
+            limites[columna] = "mínimo"
+        elif configuracion[columna] == valores.max():
+            limites[columna] = "máximo"
+    return limites
+
+
+def entrada_calendario(etiqueta, valor_base, num_meses, clave, valor_maximo=None):
+    """
+    Widgets para elegir cómo evoluciona un parámetro a lo largo de los meses:
+    constante (`valor_base`), escalón o rampa. Devuelve el escalar o el
+    calendario correspondiente (ver `expandir_calendario`).
+    """
+    col_tipo, col_meses, col_valor = st.columns(3)
+    with col_tipo:
+        tipo = st.selectbox(
+            etiqueta,
+            ["constante", "escalon", "rampa"],
+            format_func={"constante": "Constante", "escalon": "Escalón", "rampa": "Rampa"}.get,
+            key=f"{clave}_tipo"
+        )
+    if tipo == "constante":
+        return valor_base
+
+    ultimo_mes = max(num_meses, 2)
+    with col_meses:
+        if tipo == "escalon":
+            mes_cambio = st.slider("Desde el mes", 1, ultimo_mes, ultimo_mes // 2 + 1, key=f"{clave}_mes")
+        else:
+            mes_inicio, mes_fin = st.slider("Entre los meses", 1, ultimo_mes, (1, ultimo_mes), key=f"{clave}_meses")
+    with col_valor:
+        valor_nuevo = st.number_input(
+            "Nuevo valor" if tipo == "escalon" else "Valor final",
+            min_value=0.0,
+            max_value=valor_maximo,
+            value=float(valor_base),
+            key=f"{clave}_valor"
+        )
+
+    if tipo == "escalon":
+        return {"tipo": "escalon", "inicial": valor_base, "cambios": {mes_cambio: valor_nuevo}}
+    return {"tipo": "rampa", "inicial": valor_base, "final": valor_nuevo, "mes_inicio": mes_inicio, "mes_fin": mes_fin}
+
+
+def entrada_calendario_opcion(etiqueta, valor_base, opciones, num_meses, clave):
+    """
+    Widgets para elegir si una opción discreta se mantiene (`valor_base`) o
+    cambia a otra de `opciones` a partir de un mes. Devuelve la opción o el
+    calendario en escalón correspondiente (ver `expandir_calendario_opcion`).
+    """
+    col_tipo, col_meses, col_valor = st.columns(3)
+    with col_tipo:
+        tipo = st.selectbox(
+            etiqueta,
+            ["constante", "escalon"],
+            format_func={"constante": "Constante", "escalon": "Escalón"}.get,
+            key=f"{clave}_tipo"
+        )
+    if tipo == "constante":
+        return valor_base
+
+    ultimo_mes = max(num_meses, 2)
+    with col_meses:
+        mes_cambio = st.slider("Desde el mes", 1, ultimo_mes, ultimo_mes // 2 + 1, key=f"{clave}_mes")
+    with col_valor:
+        nueva_opcion = st.selectbox("Nueva opción", opciones, index=opciones.index(valor_base), key=f"{clave}_valor")
+    return {"tipo": "escalon", "inicial": valor_base, "cambios": {mes_cambio: nueva_opcion}}
+
+
 def mostrar_pestana_costes_operacion():
     st.title("Costes de Operación")
 
@@ -419,14 +1890,69 @@ def mostrar_pestana_costes_operacion():
 
     # 3) Costes Chatbot y APIs
     st.subheader("3) Costes Chatbot y APIs")
-    plan_chatbot = st.radio("Plan de Chatbot", ["Plan 1 (425,51 €/mes)", "Plan 2 (74 €/mes)"])
-    if "74" in plan_chatbot:
+    plan_chatbot = st.radio("Plan de Chatbot", ["Plan 1 (425,51 €/mes)", "Plan 2 (79 USD/mes)"])
+    if "79" in plan_chatbot:
         chatbot_plan = "plan2"
     else:
         chatbot_plan = "plan1"
 
     coste_apis_anual = st.number_input("Coste APIs anual (€)", 100, 100000, 1500)
 
+    col_uso1, col_uso2 = st.columns(2)
+    with col_uso1:
+        peticiones_chatbot_cliente = st.number_input(
+            "Conversaciones con el chatbot por cliente y mes", 0.0, 100.0, 1.0, 0.5
+        )
+    with col_uso2:
+        peticiones_apis_cliente = st.number_input(
+            "Llamadas a APIs por cliente y mes", 0.0, 100.0, 2.0, 0.5
+        )
+
+    with st.expander("Tarifas por uso (tramos)", expanded=False):
+        st.markdown("""
+        El coste del chatbot y de las APIs depende del número de peticiones del mes
+        (fisios x clientes/fisio x peticiones por cliente). Cada tramo cobra su precio
+        solo por las peticiones que caen dentro de él; el primer tramo está incluido en la cuota.
+        """)
+        for nombre, tarifa in [("Chatbot " + chatbot_plan, TARIFAS_CHATBOT[chatbot_plan]), ("APIs (exceso)", TARIFA_APIS)]:
+            st.write(f"**{nombre}** — cuota fija {tarifa['cuota']:,.2f} {tarifa['moneda']}/mes")
+            st.table(pd.DataFrame({
+                "Desde (peticiones)": tarifa["limites"],
+                f"{tarifa['moneda']}/petición": tarifa["precios"]
+            }))
+
+    # Tipo de cambio para los costes facturados en USD (GCP, APIs, chatbot plan 2)
+    st.write("#### Tipo de cambio USD → EUR")
+    col_fx1, col_fx2 = st.columns(2)
+    with col_fx1:
+        modo_tipo_cambio = st.selectbox(
+            "Modelo de tipo de cambio",
+            ["fijo", "estocastico", "historico"],
+            format_func={"fijo": "Fijo", "estocastico": "Estocástico", "historico": "Serie histórica (CSV)"}.get
+        )
+        tipo_cambio_inicial = st.number_input("EUR por 1 USD (mes 1)", 0.5, 1.5, TIPO_CAMBIO_USD_EUR, 0.01)
+    with col_fx2:
+        volatilidad_tipo_cambio = st.slider(
+            "Volatilidad anual del tipo de cambio (%)", 0, 30, 8,
+            disabled=modo_tipo_cambio != "estocastico"
+        )
+        archivo_tipo_cambio = st.file_uploader(
+            "CSV con columna 'usd_eur' (un valor por mes)", type="csv",
+            disabled=modo_tipo_cambio != "historico"
+        )
+
+    modelo_tipo_cambio = {
+        "modo": modo_tipo_cambio,
+        "tipo_inicial": tipo_cambio_inicial,
+        "volatilidad_anual": volatilidad_tipo_cambio / 100.0
+    }
+    if modo_tipo_cambio == "historico":
+        if archivo_tipo_cambio is None:
+            st.warning("Sube un CSV con la serie de tipos de cambio. Mientras tanto se usa el tipo fijo.")
+            modelo_tipo_cambio["modo"] = "fijo"
+        else:
+            modelo_tipo_cambio["serie"] = leer_serie_tipo_cambio(archivo_tipo_cambio)
+
     # 4) Mantenimiento
     st.subheader("4) Mantenimiento")
     with st.expander("Detalles de Mantenimiento", expanded=False):
@@ -453,26 +1979,115 @@ def mostrar_pestana_costes_operacion():
     # Factor de ruido
     ruido_factor = st.slider("Factor de fluctuación aleatoria", 0.0, 0.5, 0.3, 0.05)
 
-    # Botón para recalcular (cada vez que se hace clic, se generan nuevas fluctuaciones)
+    # Parámetros que cambian a lo largo del período (partiendo de los valores anteriores)
+    with st.expander("Parámetros variables en el tiempo", expanded=False):
+        st.markdown("""
+        Cada parámetro parte del valor definido arriba y puede mantenerse
+        **constante**, cambiar de golpe a partir de un mes (**escalón**, p.ej. una
+        campaña de marketing) o evolucionar linealmente entre dos meses (**rampa**,
+        p.ej. la adopción progresiva del plan premium). El almacenamiento, el plan
+        de chatbot y el mantenimiento solo admiten escalón.
+        """)
+        col_mk1, col_mk2 = st.columns(2)
+        with col_mk1:
+            marketing_horas = st.number_input("Horas de marketing al mes (base)", 0, 500, 15)
+        with col_mk2:
+            marketing_tarifa = st.number_input("Tarifa de marketing (€/h, base)", 0.0, 200.0, 25.0, 1.0)
+        porcentaje_premium = entrada_calendario(
+            "Porcentaje Fisios Premium (%)", porcentaje_premium, num_meses, "calendario_premium", 100.0
+        )
+        porcentaje_consumo = entrada_calendario(
+            "Porcentaje de consumo de vídeos (%)", porcentaje_consumo, num_meses, "calendario_consumo", 100.0
+        )
+        basic_videos = entrada_calendario("Vídeos por Fisio (Básico)", basic_videos, num_meses, "calendario_basic")
+        premium_videos = entrada_calendario("Vídeos por Fisio (Premium)", premium_videos, num_meses, "calendario_premium_videos")
+        coste_apis_anual = entrada_calendario("Coste APIs anual (€)", coste_apis_anual, num_meses, "calendario_apis")
+        marketing_horas = entrada_calendario("Horas de marketing al mes", marketing_horas, num_meses, "calendario_marketing")
+        marketing_tarifa = entrada_calendario(
+            "Tarifa de marketing (€/h)", marketing_tarifa, num_meses, "calendario_marketing_tarifa"
+        )
+        peticiones_chatbot_cliente = entrada_calendario(
+            "Conversaciones con el chatbot por cliente y mes", peticiones_chatbot_cliente, num_meses, "calendario_chatbot"
+        )
+        peticiones_apis_cliente = entrada_calendario(
+            "Llamadas a APIs por cliente y mes", peticiones_apis_cliente, num_meses, "calendario_peticiones_apis"
+        )
+        tipo_almacenamiento = entrada_calendario_opcion(
+            "Tipo de almacenamiento GCP", tipo_almacenamiento, OPCIONES_ALMACENAMIENTO, num_meses,
+            "calendario_almacenamiento"
+        )
+        chatbot_plan = entrada_calendario_opcion(
+            "Plan de Chatbot", chatbot_plan, OPCIONES_CHATBOT, num_meses, "calendario_chatbot_plan"
+        )
+        modo_mantenimiento_adaptativo = entrada_calendario_opcion(
+            "Mantenimiento Adaptativo", modo_mantenimiento_adaptativo, OPCIONES_MANTENIMIENTO, num_meses,
+            "calendario_mantenimiento"
+        )
+
+        calendarios = {
+            etiqueta: expandir_calendario(valor, num_meses)
+            for etiqueta, valor in [
+                ("% premium", porcentaje_premium),
+                ("% consumo", porcentaje_consumo),
+                ("Vídeos básico", basic_videos),
+                ("Vídeos premium", premium_videos),
+                ("APIs anual (€)", coste_apis_anual),
+                ("Horas marketing", marketing_horas),
+                ("Tarifa marketing (€/h)", marketing_tarifa),
+                ("Conversaciones/cliente", peticiones_chatbot_cliente),
+                ("Llamadas APIs/cliente", peticiones_apis_cliente)
+            ]
+            if isinstance(valor, dict)
+        }
+        if calendarios:
+            st.line_chart(pd.DataFrame(calendarios, index=pd.Index(np.arange(1, num_meses + 1), name="Mes")))
+
+    # Semilla: fija para reproducir un resultado, o nueva en cada clic
+    col7, col8 = st.columns(2)
+    with col7:
+        fijar_semilla = st.checkbox("Fijar semilla (resultado reproducible)", value=False)
+    with col8:
+        semilla_fija = st.number_input("Semilla", min_value=0, max_value=2**31 - 1, value=42, disabled=not fijar_semilla)
+
+    # Parámetros comunes al desglose individual y a la simulación Monte Carlo
+    parametros_simulacion = dict(
+        fisios_inicial=fisios_inicial,
+        fisios_final=fisios_final,
+        clientes_inicial=clientes_inicial,
+        clientes_final=clientes_final,
+        basic_videos=basic_videos,
+        premium_videos=premium_videos,
+        porcentaje_premium=porcentaje_premium,
+        porcentaje_consumo=porcentaje_consumo,
+        tipo_almacenamiento=tipo_almacenamiento,
+        incidencias_iniciales=incidencias_iniciales,
+        decremento_incidencias=decremento_incidencias,
+        modo_mantenimiento_adaptativo=modo_mantenimiento_adaptativo,
+        chatbot_plan=chatbot_plan,
+        coste_apis_anual=coste_apis_anual,
+        num_meses=num_meses,
+        ruido_factor=ruido_factor,
+        peticiones_chatbot_cliente=peticiones_chatbot_cliente,
+        peticiones_apis_cliente=peticiones_apis_cliente,
+        marketing_horas=marketing_horas,
+        marketing_tarifa=marketing_tarifa
+    )
+    # Se guardan para la pestaña de optimización
+    st.session_state["parametros_operacion"] = parametros_simulacion
+    st.session_state["modelo_tipo_cambio"] = modelo_tipo_cambio
+
+    # Botón para recalcular (sin semilla fija, cada clic genera nuevas fluctuaciones)
     if st.button("Generar Desglose"):
-        df_result = calcular_costes_operacion_simulacion(
-            fisios_inicial=fisios_inicial,
-            fisios_final=fisios_final,
-            clientes_inicial=clientes_inicial,
-            clientes_final=clientes_final,
-            basic_videos=basic_videos,
-            premium_videos=premium_videos,
-            porcentaje_premium=porcentaje_premium,
-            porcentaje_consumo=porcentaje_consumo,
-            tipo_almacenamiento=tipo_almacenamiento,
-            incidencias_iniciales=incidencias_iniciales,
-            decremento_incidencias=decremento_incidencias,
-            modo_mantenimiento_adaptativo=modo_mantenimiento_adaptativo,
-            chatbot_plan=chatbot_plan,
-            coste_apis_anual=coste_apis_anual,
-            num_meses=num_meses,
-            ruido_factor=ruido_factor
+        semilla = int(semilla_fija) if fijar_semilla else random.SystemRandom().randrange(2**31)
+        tipos_cambio = generar_tipo_cambio(
+            1, num_meses, rng=np.random.default_rng(semilla), **modelo_tipo_cambio
+        )[0]
+        df_result = simular_operacion_reproducible(
+            semilla=semilla,
+            tipo_cambio_usd_eur=tipos_cambio,
+            **parametros_simulacion
         )
+        df_result.attrs["modelo_tipo_cambio"] = _normalizar_parametro(modelo_tipo_cambio)
 
         # 6) Mostrar tabla
         st.subheader("Desglose Mensual de Costes")
@@ -503,17 +2118,101 @@ def mostrar_pestana_costes_operacion():
         # Métrica de coste total
         coste_total = df_result["Total Mensual"].sum()
         st.session_state["df_operacion"] = df_display
+        st.session_state["df_operacion_resultado"] = df_result
         st.info(f"**Coste Total del Período:** {coste_total:,.2f} €")
+        st.caption(
+            f"Semilla: {semilla} · Motor v{VERSION_MOTOR} · Huella: `{df_result.attrs['huella']}`"
+        )
 
 
     else:
         st.warning("Haz clic en 'Generar Desglose' para ver el resultado.")
 
+    # 7) Simulación Monte Carlo
+    st.subheader("6) Simulación Monte Carlo")
+    st.info("""
+    Repite la simulación para muchos escenarios a la vez y muestra la
+    dispersión del coste mensual (percentiles 5, 50 y 95).
+    """)
+    num_escenarios = st.number_input("Número de escenarios", min_value=100, max_value=1000000, value=10000, step=1000)
+
+    if st.button("Simular Escenarios"):
+        semilla = int(semilla_fija) if fijar_semilla else random.SystemRandom().randrange(2**31)
+        lote = simular_lote_reproducible(
+            int(num_escenarios),
+            semilla,
+            modelo_tipo_cambio=modelo_tipo_cambio,
+            **parametros_simulacion
+        )
+        st.session_state["lote_operacion"] = lote
+
+        percentiles = np.percentile(lote["Total Mensual"], [5, 50, 95], axis=0)
+        df_percentiles = pd.DataFrame({
+            "P5": percentiles[0],
+            "P50 (mediana)": percentiles[1],
+            "P95": percentiles[2]
+        }, index=pd.Index(lote["Mes"], name="Mes"))
+        st.line_chart(df_percentiles)
+
+        coste_total_escenarios = lote["Total Mensual"].sum(axis=1, dtype=np.float64)
+        col_mc1, col_mc2, col_mc3 = st.columns(3)
+        col_mc1.metric("Coste Total P5", f"{np.percentile(coste_total_escenarios, 5):,.2f} €")
+        col_mc2.metric("Coste Total Mediano", f"{np.median(coste_total_escenarios):,.2f} €")
+        col_mc3.metric("Coste Total P95", f"{np.percentile(coste_total_escenarios, 95):,.2f} €")
+        st.caption(
+            f"Semilla: {semilla} · Memoria del lote: {lote.nbytes / 1024**2:,.1f} MB · "
+            f"Motor v{VERSION_MOTOR} · Huella: `{lote.huella}`"
+        )
+
+        with st.expander("Desglose del escenario mediano", expanded=False):
+            escenario_mediano = int(np.argsort(coste_total_escenarios)[lote.num_escenarios // 2])
+            st.write(f"Escenario {escenario_mediano} (coste total {coste_total_escenarios[escenario_mediano]:,.2f} €)")
+            st.dataframe(lote.a_dataframe(escenario_mediano))
+
 
 
 # -------------------------------------------------
 # SECCION ROI
 # -------------------------------------------------
+def calcular_roi(df_operacion, coste_desarrollo, precio_standard, precio_premium, porcentaje_premium, factor_moneda=1.0):
+    """
+    Calcula ingresos, costes acumulados y ROI mes a mes a partir del desglose
+    de operación (con columnas numéricas).
+
+    `factor_moneda` (escalar o serie por mes) convierte los ingresos, que se
+    introducen en €, a la moneda del informe. Los precios y el % premium
+    admiten un calendario por mes (ver `expandir_calendario`).
+
+    Returns:
+        tuple: (DataFrame con el ROI mensual, mes de equilibrio o None).
+    """
+    num_meses = len(df_operacion)
+    precio_standard = expandir_calendario(precio_standard, num_meses)
+    precio_premium = expandir_calendario(precio_premium, num_meses)
+    porcentaje_premium = expandir_calendario(porcentaje_premium, num_meses)
+
+    df_roi = df_operacion.copy()
+    df_roi["Fisios Premium"] = df_roi["Fisios"] * (porcentaje_premium / 100.0)
+    df_roi["Fisios Standard"] = df_roi["Fisios"] - df_roi["Fisios Premium"]
+    df_roi["Ingresos Mensuales"] = (
+        df_roi["Fisios Standard"] * precio_standard +
+        df_roi["Fisios Premium"] * precio_premium
+    ) * factor_moneda
+
+    # Calculamos costes e ingresos acumulados
+    df_roi["Costes Acumulados"] = coste_desarrollo + df_roi["Total Mensual"].cumsum()
+    df_roi["Ingresos Acumulados"] = df_roi["Ingresos Mensuales"].cumsum()
+    df_roi["ROI"] = df_roi["Ingresos Acumulados"] - df_roi["Costes Acumulados"]
+
+    # Punto de equilibrio: primer mes con ROI >= 0
+    break_even_month = None
+    for idx, row in df_roi.iterrows():
+        if row["ROI"] >= 0:
+            break_even_month = row["Mes"]
+            break
+
+    return df_roi, break_even_month
+
 def mostrar_pestana_proyeccion_y_roi():
     st.header("Proyección de Ingresos y ROI")
     
@@ -540,26 +2239,43 @@ def mostrar_pestana_proyeccion_y_roi():
                 if isinstance(x, str) else x
             )
 
+    # Moneda del informe: los costes se simulan en EUR; para USD se divide cada
+    # mes por su tipo de cambio (EUR por 1 USD) de forma vectorizada
+    moneda_informe = st.radio("Moneda del informe", ["EUR", "USD"], horizontal=True)
+    simbolo = "€" if moneda_informe == "EUR" else "$"
+    if moneda_informe == "USD":
+        tipos_cambio = df_operacion_num.get(
+            "Tipo de cambio USD/EUR",
+            pd.Series(TIPO_CAMBIO_USD_EUR, index=df_operacion_num.index)
+        )
+        factor_moneda = 1.0 / tipos_cambio
+    else:
+        factor_moneda = pd.Series(1.0, index=df_operacion_num.index)
+
+    columnas_a_convertir = [c for c in columnas_monetarias + ["Marketing"] if c in df_operacion_num.columns]
+    df_operacion_num[columnas_a_convertir] = df_operacion_num[columnas_a_convertir].mul(factor_moneda, axis=0)
+    coste_desarrollo = coste_desarrollo * factor_moneda.iloc[0]
+
     # 3. Mostrar métricas iniciales
     col1, col2, col3, col4 = st.columns(4)
     with col1:
         st.metric(
             "💰 Inversión Inicial",
-            f"{coste_desarrollo:,.2f}€",
+            f"{coste_desarrollo:,.2f}{simbolo}",
             help="Coste total del desarrollo inicial"
         )
     with col2:
         coste_mensual_promedio = df_operacion_num["Total Mensual"].mean()
         st.metric(
             "⚙️ Coste Operativo Mensual Promedio",
-            f"{coste_mensual_promedio:,.2f}€",
+            f"{coste_mensual_promedio:,.2f}{simbolo}",
             help="Promedio de costes mensuales de operación"
         )
     with col3:
         coste_anual = coste_mensual_promedio * 12
         st.metric(
             "📅 Coste Operativo Anual",
-            f"{coste_anual:,.2f}€",
+            f"{coste_anual:,.2f}{simbolo}",
             help="Proyección del coste operativo anual"
         )
     with col4:
@@ -591,45 +2307,46 @@ def mostrar_pestana_proyeccion_y_roi():
             step=0.5,
             format="%.2f"
         )
+    with st.expander("Cambios de precio en el tiempo", expanded=False):
+        precio_standard = entrada_calendario("Evolución del precio Standard", precio_standard, num_meses, "calendario_precio_standard")
+        precio_premium = entrada_calendario("Evolución del precio Premium", precio_premium, num_meses, "calendario_precio_premium")
 
     # 5. Cálculo de ingresos y ROI
     st.subheader("📊 Análisis de ROI")
     
-    porcentaje_premium = st.slider(
-        "Porcentaje de Fisios Premium",
-        0, 100, 30,
-        help="Porcentaje de fisioterapeutas que eligen el plan Premium"
-    )
+    # El % premium (constante o calendario) es el mismo con el que se simularon
+    # los costes, para que ingresos y costes sigan la misma adopción del plan
+    df_operacion_resultado = st.session_state.get("df_operacion_resultado")
+    parametros_generacion = df_operacion_resultado.attrs.get("parametros", {}) if df_operacion_resultado is not None else {}
+    porcentaje_premium = parametros_generacion.get("porcentaje_premium", 30)
+    serie_premium = expandir_calendario(porcentaje_premium, num_meses)
+    if np.ptp(serie_premium) == 0:
+        st.caption(f"Porcentaje de Fisios Premium (pestaña de operación): {serie_premium[0]:.0f}%")
+    else:
+        st.caption(
+            f"Porcentaje de Fisios Premium (calendario de la pestaña de operación): "
+            f"del {serie_premium[0]:.0f}% en el mes 1 al {serie_premium[-1]:.0f}% en el mes {num_meses}"
+        )
 
     # Usar el DataFrame con valores numéricos para los cálculos
-    df_roi = df_operacion_num.copy()
-    df_roi["Fisios Premium"] = df_roi["Fisios"] * (porcentaje_premium / 100.0)
-    df_roi["Fisios Standard"] = df_roi["Fisios"] - df_roi["Fisios Premium"]
-    df_roi["Ingresos Mensuales"] = (
-        df_roi["Fisios Standard"] * precio_standard +
-        df_roi["Fisios Premium"] * precio_premium
+    df_roi, break_even_month = calcular_roi(
+        df_operacion_num,
+        coste_desarrollo,
+        precio_standard,
+        precio_premium,
+        porcentaje_premium,
+        factor_moneda
     )
 
-    # Calculamos costes e ingresos acumulados
-    df_roi["Costes Acumulados"] = coste_desarrollo + df_roi["Total Mensual"].cumsum()
-    df_roi["Ingresos Acumulados"] = df_roi["Ingresos Mensuales"].cumsum()
-    df_roi["ROI"] = df_roi["Ingresos Acumulados"] - df_roi["Costes Acumulados"]
-
     # 6. Punto de equilibrio y análisis
-    break_even_month = None
-    for idx, row in df_roi.iterrows():
-        if row["ROI"] >= 0:
-            break_even_month = row["Mes"]
-            break
-
     if break_even_month:
         st.success(f"🎯 Punto de equilibrio alcanzado en el mes {int(break_even_month)}")
     else:
         # Calcular fisios necesarios para punto de equilibrio
         ultimo_mes = df_roi.iloc[-1]
         costes_mensuales = ultimo_mes["Total Mensual"]
-        precio_promedio = (precio_standard * (1 - porcentaje_premium/100) + 
-                         precio_premium * (porcentaje_premium/100))
+        precio_promedio = (expandir_calendario(precio_standard, num_meses)[-1] * (1 - serie_premium[-1]/100) +
+                         expandir_calendario(precio_premium, num_meses)[-1] * (serie_premium[-1]/100)) * factor_moneda.iloc[-1]
         
         fisios_necesarios = (costes_mensuales + (coste_desarrollo / num_meses)) / precio_promedio
         fisios_actuales = ultimo_mes["Fisios"]
@@ -641,8 +2358,8 @@ def mostrar_pestana_proyeccion_y_roi():
             f"⚠️ No se alcanza el punto de equilibrio en el período analizado. "
             f"Para alcanzarlo necesitarías:\n\n"
             f"- Aumentar a {fisios_necesarios:.0f} fisios (actualmente {fisios_actuales:.0f}) o\n"
-            f"- Incrementar el precio promedio en {incremento_precio_necesario:.2f}€ "
-            f"(actualmente {precio_promedio:.2f}€)"
+            f"- Incrementar el precio promedio en {incremento_precio_necesario:.2f}{simbolo} "
+            f"(actualmente {precio_promedio:.2f}{simbolo})"
         )
 
     # Resto del código igual...
@@ -656,7 +2373,7 @@ def mostrar_pestana_proyeccion_y_roi():
              label="ROI", marker='o')
     ax1.axhline(y=0, color='r', linestyle='--', alpha=0.3)
     ax1.set_xlabel("Mes")
-    ax1.set_ylabel("Euros")
+    ax1.set_ylabel("Euros" if moneda_informe == "EUR" else "Dólares")
     ax1.set_title("Evolución de Ingresos, Costes y ROI")
     ax1.legend()
     ax1.grid(True, alpha=0.3)
@@ -670,7 +2387,7 @@ def mostrar_pestana_proyeccion_y_roi():
         "Ingresos Acumulados", "ROI"
     ]
     for col in columnas_formato:
-        df_display[col] = df_display[col].apply(lambda x: f"{x:,.2f}€")
+        df_display[col] = df_display[col].apply(lambda x: f"{x:,.2f}{simbolo}")
     st.dataframe(df_display)
 
     # 9. Métricas finales
@@ -680,34 +2397,922 @@ def mostrar_pestana_proyeccion_y_roi():
         roi_final = df_roi["ROI"].iloc[-1]
         st.metric(
             "ROI Final",
-            f"{roi_final:,.2f}€",
+            f"{roi_final:,.2f}{simbolo}",
             delta=f"{(roi_final/coste_desarrollo*100):,.1f}%" if roi_final > 0 else None
         )
     with col2:
         ingresos_ultimo_mes = df_roi["Ingresos Mensuales"].iloc[-1]
         st.metric(
             "Ingresos Último Mes",
-            f"{ingresos_ultimo_mes:,.2f}€"
+            f"{ingresos_ultimo_mes:,.2f}{simbolo}"
         )
     with col3:
         margen_ultimo_mes = ingresos_ultimo_mes - df_roi["Total Mensual"].iloc[-1]
         st.metric(
             "Margen Último Mes",
-            f"{margen_ultimo_mes:,.2f}€",
+            f"{margen_ultimo_mes:,.2f}{simbolo}",
             delta=f"{(margen_ultimo_mes/ingresos_ultimo_mes*100):,.1f}%"
         )
+    # 10. Métricas financieras (flujos descontados)
+    st.subheader("💹 Métricas Financieras")
+    col1, col2 = st.columns(2)
+    with col1:
+        tasas_seleccionadas = st.multiselect(
+            "Tasas de descuento anuales",
+            TASAS_DESCUENTO,
+            default=TASAS_DESCUENTO,
+            format_func=lambda tasa: f"{tasa:.0%}"
+        )
+    with col2:
+        tasa_payback = st.select_slider(
+            "Tasa para el payback descontado",
+            TASAS_DESCUENTO,
+            value=0.10,
+            format_func=lambda tasa: f"{tasa:.0%}"
+        )
+    tasas_seleccionadas = sorted(tasas_seleccionadas) or [tasa_payback]
+
+    flujos = calcular_flujos_caja(df_roi["Ingresos Mensuales"], df_roi["Total Mensual"], coste_desarrollo)
+    van = calcular_van(flujos, tasas_seleccionadas)
+    tir = calcular_tir(flujos)
+    payback = calcular_payback_descontado(flujos, tasa_payback)
+
+    cols_van = st.columns(len(tasas_seleccionadas) + 2)
+    for col, tasa, valor in zip(cols_van, tasas_seleccionadas, van):
+        col.metric(f"VAN al {tasa:.0%}", f"{valor:,.2f}{simbolo}")
+    cols_van[-2].metric("TIR anual", "No alcanzada" if np.isnan(tir) else f"{tir:.1%}")
+    cols_van[-1].metric(
+        f"Payback descontado ({tasa_payback:.0%})",
+        "No alcanzado" if np.isnan(payback) else f"Mes {int(payback)}"
+    )
+
+    # Distribución sobre los escenarios Monte Carlo de la pestaña de operación
+    lote = st.session_state.get("lote_operacion")
+    if lote is not None:
+        st.write("#### Distribución sobre los escenarios simulados")
+        # Cada lote usa el % premium con el que se simularon sus costes
+        ratio_premium_lote = expandir_calendario(
+            lote.metadatos.get("parametros", {}).get("porcentaje_premium", porcentaje_premium), lote.num_meses
+        ) / 100
+        precio_medio = (expandir_calendario(precio_standard, lote.num_meses) * (1 - ratio_premium_lote) +
+                        expandir_calendario(precio_premium, lote.num_meses) * ratio_premium_lote)
+        factor_lote = 1.0 if moneda_informe == "EUR" else 1.0 / lote["Tipo de cambio USD/EUR"]
+        flujos_lote = calcular_flujos_caja(
+            lote["Fisios"] * precio_medio * factor_lote,
+            lote["Total Mensual"] * factor_lote,
+            coste_desarrollo
+        )
+        df_resumen = resumen_metricas_financieras(flujos_lote, tasas_seleccionadas, tasa_payback)
+        st.dataframe(df_resumen.style.format("{:,.2f}", na_rep="—"))
+        st.caption(
+            f"{lote.num_escenarios:,} escenarios · TIR en tanto por uno · "
+            "La última columna indica el % de escenarios con TIR o payback dentro del horizonte."
+        )
+
+    # La moneda y la inversión convertida viajan con la tabla para la exportación
+    df_roi.attrs["moneda"] = moneda_informe
+    df_roi.attrs["coste_desarrollo"] = coste_desarrollo
+    st.session_state["df_roi"] = df_roi
     st.subheader("📜 Reporte Detallado")
     coste_total_operacion = df_roi["Total Mensual"].sum()  # Suma de todos los costes mensuales (sin acumular dev)
     st.markdown(f"""
-- **Coste de Desarrollo (inversión inicial):** {coste_desarrollo:,.2f}€
-- **Coste de Operación total (período analizado):** {coste_total_operacion:,.2f}€
-- **ROI final:** {roi_final:,.2f}€
+- **Coste de Desarrollo (inversión inicial):** {coste_desarrollo:,.2f}{simbolo}
+- **Coste de Operación total (período analizado):** {coste_total_operacion:,.2f}{simbolo}
+- **ROI final:** {roi_final:,.2f}{simbolo}
 - **Punto de equilibrio:** {'Mes ' + str(int(break_even_month)) if break_even_month else 'No alcanzado'}
 - **Resumen**:
   - Este reporte muestra la suma de **Costes de Desarrollo** y el **Coste Operativo** mes a mes, 
   - comparándolo con los **Ingresos Mensuales** calculados a partir de la configuración actual de precios.
 """)
 
+# -------------------------------------------------
+# SECCION OPTIMIZACIÓN
+# -------------------------------------------------
+def mostrar_pestana_optimizacion():
+    st.header("Optimización de la Configuración")
+
+    coste_desarrollo = st.session_state.get("coste_desarrollo")
+    parametros_base = st.session_state.get("parametros_operacion")
+    if coste_desarrollo is None or parametros_base is None:
+        st.error("⚠️ Necesitas completar las secciones anteriores primero")
+        return
+
+    st.info("""
+    Busca el tipo de almacenamiento, plan de chatbot, modo de mantenimiento y
+    precios que maximizan el objetivo elegido. Los fisios y su % premium
+    responden a los precios según el modelo de demanda. Todas las
+    configuraciones se comparan sobre los mismos escenarios simulados y las
+    claramente peores se descartan pronto. El resto de parámetros se toma de la
+    pestaña de Costes de Operación.
+    """)
+
+    # 1. Objetivo
+    col1, col2 = st.columns(2)
+    with col1:
+        objetivo = st.radio(
+            "Objetivo",
+            ["van", "equilibrio"],
+            format_func={"van": "Maximizar VAN esperado", "equilibrio": "Maximizar prob. de equilibrio"}.get
+        )
+    with col2:
+        if objetivo == "van":
+            tasa_descuento = st.select_slider(
+                "Tasa de descuento anual", TASAS_DESCUENTO, value=0.10,
+                format_func=lambda tasa: f"{tasa:.0%}"
+            )
+            mes_equilibrio = None
+        else:
+            tasa_descuento = 0.10
+            mes_equilibrio = st.slider(
+                "Alcanzar el equilibrio como muy tarde en el mes",
+                1, parametros_base["num_meses"], parametros_base["num_meses"]
+            )
+
+    # 2. Espacio de búsqueda
+    st.subheader("Espacio de Búsqueda")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        rango_precio_standard = st.slider("Precio Standard (€/mes)", 0.0, 100.0, (10.0, 30.0), 0.5)
+        rango_precio_premium = st.slider("Precio Premium (€/mes)", 0.0, 100.0, (15.0, 40.0), 0.5)
+    with col2:
+        pasos_precio = st.number_input("Valores por precio", 2, 20, 6)
+        cuota_mercado = st.slider(
+            "Cuota de mercado a precios de referencia", 0.05, 0.95, CUOTA_MERCADO_REFERENCIA, 0.05,
+            help="Fracción del mercado potencial que representan los fisios de la pestaña de "
+                 "operación a 17.99€ / 24.99€. Bajando precios como mucho se capta el resto."
+        )
+    with col3:
+        elasticidad_precio = st.number_input(
+            "Elasticidad de la demanda al precio", 0.0, 5.0, 1.2, 0.1,
+            help="Con 0 el número de fisios no depende del precio"
+        )
+        elasticidad_premium = st.number_input(
+            "Elasticidad del % premium a la diferencia de precio", 0.0, 5.0, 1.0, 0.1,
+            help="Con 0 el % premium es siempre el de la pestaña de operación"
+        )
+
+    col1, col2 = st.columns(2)
+    with col1:
+        escenarios_maximos = st.select_slider("Escenarios máximos", [800, 1600, 3200, 6400, 12800], value=3200)
+    with col2:
+        semilla = st.number_input("Semilla de la optimización", 0, 2**31 - 1, 42)
+
+    candidatos = generar_candidatos(rango_precio_standard, rango_precio_premium, int(pasos_precio))
+    segundos_estimados = estimar_celdas_optimizacion(
+        len(candidatos), parametros_base["num_meses"], escenarios_maximos=escenarios_maximos
+    ) / CELDAS_POR_SEGUNDO_OPTIMIZACION
+    demasiado_larga = segundos_estimados > MAX_SEGUNDOS_OPTIMIZACION
+    st.caption(f"{len(candidatos):,} configuraciones; tiempo estimado: hasta ~{segundos_estimados:.0f} s.")
+    if demasiado_larga:
+        st.warning(
+            f"⚠️ La búsqueda podría tardar más de {MAX_SEGUNDOS_OPTIMIZACION} s. "
+            "Reduce los valores por precio o los escenarios máximos."
+        )
+
+    if st.button("Optimizar", disabled=demasiado_larga):
+        with st.spinner(f"Evaluando {len(candidatos):,} configuraciones..."):
+            ranking = optimizar_configuracion(
+                parametros_base,
+                coste_desarrollo,
+                objetivo=objetivo,
+                tasa_descuento=tasa_descuento,
+                mes_equilibrio=mes_equilibrio,
+                candidatos=candidatos,
+                elasticidad_precio=elasticidad_precio,
+                elasticidad_premium=elasticidad_premium,
+                cuota_mercado=cuota_mercado,
+                escenarios_maximos=escenarios_maximos,
+                semilla=int(semilla),
+                modelo_tipo_cambio=st.session_state.get("modelo_tipo_cambio")
+            )
+
+        # 3. Resultados
+        mejor = ranking.iloc[0]
+        st.success(
+            f"🏆 Mejor configuración: almacenamiento **{mejor['tipo_almacenamiento']}**, "
+            f"chatbot **{mejor['chatbot_plan']}**, mantenimiento **{mejor['modo_mantenimiento_adaptativo']}**, "
+            f"precios **{mejor['precio_standard']:.2f}€ / {mejor['precio_premium']:.2f}€** "
+            f"(resultan **{mejor['porcentaje_premium']:.1f}%** de fisios premium y "
+            f"**{mejor['demanda_relativa']:.0%}** de los fisios de referencia)."
+        )
+        limites = valores_en_limite(mejor, candidatos)
+        if limites:
+            nombres = {
+                "precio_standard": "precio Standard",
+                "precio_premium": "precio Premium"
+            }
+            st.warning(
+                "⚠️ El óptimo está en el borde del espacio de búsqueda ("
+                + ", ".join(f"{nombres[columna]} en su {limite}" for columna, limite in limites.items())
+                + "). Amplía ese rango antes de fiarte del resultado."
+            )
+        if objetivo == "van":
+            st.metric("VAN esperado", f"{mejor['objetivo']:,.2f}€", help=f"± {mejor['error_estandar']:,.2f}€ (error estándar)")
+        else:
+            st.metric("Probabilidad de equilibrio", f"{mejor['objetivo']:.1%}", help=f"± {mejor['error_estandar']:.1%} (error estándar)")
+
+        st.write("#### Ranking de configuraciones")
+        st.dataframe(ranking.head(50))
+        st.caption(
+            f"{len(ranking):,} configuraciones evaluadas; "
+            f"{(ranking['escenarios'] == ranking['escenarios'].max()).sum()} llegaron a {ranking['escenarios'].max():,} escenarios."
+        )
+
+# -------------------------------------------------
+# EJECUCIONES GUARDADAS Y COMPARACIÓN
+# -------------------------------------------------
+# Cada ejecución se guarda en su propia carpeta: un .npy por columna del lote
+# y un meta.json con el nombre, los parámetros y las dimensiones. Al cargarla,
+# las columnas se mapean en memoria, así que solo se lee lo que se usa.
+DIRECTORIO_EJECUCIONES = os.environ.get("FISIOFIND_RUNS_DIR", "ejecuciones_guardadas")
+
+ESTADISTICOS_COMPARACION = ["Media", "P5", "P50", "P95"]
+_CUANTILES_WASSERSTEIN = np.linspace(0.01, 0.99, 99)
+
+
+def _nombre_fichero_columna(nombre):
+    return hashlib.sha1(nombre.encode("utf-8")).hexdigest()[:12] + ".npy"
+
+
+def guardar_ejecucion(nombre, lote):
+    """
+    Guarda un `LoteOperacion` en DIRECTORIO_EJECUCIONES y devuelve su identificador.
+
+    Los parámetros, la semilla y el modelo de tipo de cambio se toman de
+    `lote.metadatos`, capturados al generar el resultado (no de los controles
+    actuales, que pueden haber cambiado desde entonces).
+    """
+    identificador = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    destino = os.path.join(DIRECTORIO_EJECUCIONES, identificador)
+    temporal = destino + ".tmp"
+    os.makedirs(temporal)
+
+    ficheros = {}
+    for columna, valores in lote.columnas.items():
+        ficheros[columna] = _nombre_fichero_columna(columna)
+        np.save(os.path.join(temporal, ficheros[columna]), valores)
+
+    meta = {
+        "id": identificador,
+        "nombre": nombre,
+        "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "num_escenarios": lote.num_escenarios,
+        "num_meses": lote.num_meses,
+        "huella": lote.huella,
+        "version_motor": VERSION_MOTOR,
+        "columnas": ficheros,
+        "parametros": _normalizar_parametro(lote.metadatos.get("parametros", {})),
+        "semilla": _normalizar_parametro(lote.metadatos.get("semilla")),
+        "modelo_tipo_cambio": _normalizar_parametro(lote.metadatos.get("modelo_tipo_cambio"))
+    }
+    with open(os.path.join(temporal, "meta.json"), "w", encoding="utf-8") as fichero:
+        json.dump(meta, fichero, indent=1, ensure_ascii=False)
+
+    # La carpeta solo aparece con su nombre definitivo cuando está completa
+    os.replace(temporal, destino)
+    return identificador
+
+
+COLUMNAS_LISTADO_EJECUCIONES = ["id", "nombre", "fecha", "num_escenarios", "num_meses", "semilla", "version_motor"]
+
+
+def listar_ejecuciones():
+    """
+    Devuelve un DataFrame con los metadatos de las ejecuciones guardadas.
+    """
+    filas = []
+    if os.path.isdir(DIRECTORIO_EJECUCIONES):
+        for identificador in sorted(os.listdir(DIRECTORIO_EJECUCIONES)):
+            ruta_meta = os.path.join(DIRECTORIO_EJECUCIONES, identificador, "meta.json")
+            if not os.path.isfile(ruta_meta):
+                continue
+            with open(ruta_meta, encoding="utf-8") as fichero:
+                meta = json.load(fichero)
+            filas.append({k: meta.get(k) for k in COLUMNAS_LISTADO_EJECUCIONES})
+    return pd.DataFrame(filas, columns=COLUMNAS_LISTADO_EJECUCIONES)
+
+
+def cargar_ejecucion(identificador):
+    """
+    Carga una ejecución guardada como `LoteOperacion` con las columnas
+    mapeadas en memoria (solo lectura).
+
+    Returns:
+        tuple: (lote, metadatos).
+    """
+    carpeta = os.path.join(DIRECTORIO_EJECUCIONES, identificador)
+    with open(os.path.join(carpeta, "meta.json"), encoding="utf-8") as fichero:
+        meta = json.load(fichero)
+    columnas = {
+        columna: np.load(os.path.join(carpeta, fichero), mmap_mode="r")
+        for columna, fichero in meta["columnas"].items()
+    }
+    lote = LoteOperacion.desde_columnas(columnas)
+    lote.huella = meta.get("huella")
+    lote.metadatos = {
+        clave: meta[clave]
+        for clave in ["parametros", "semilla", "modelo_tipo_cambio"]
+        if clave in meta
+    }
+    return lote, meta
+
+
+def _estadisticos_por_mes(columna, max_elementos=5000000):
+    """
+    Media, percentiles y cuantiles (para Wasserstein) de cada mes de una
+    columna (escenarios, meses), leyendo la columna por bloques de meses.
+
+    Returns:
+        tuple: (estadísticos (len(ESTADISTICOS_COMPARACION), meses),
+                cuantiles (len(_CUANTILES_WASSERSTEIN), meses)).
+    """
+    num_escenarios, num_meses = columna.shape
+    estadisticos = np.empty((len(ESTADISTICOS_COMPARACION), num_meses))
+    cuantiles = np.empty((len(_CUANTILES_WASSERSTEIN), num_meses))
+    meses_por_bloque = max(1, max_elementos // max(num_escenarios, 1))
+
+    for inicio in range(0, num_meses, meses_por_bloque):
+        bloque = np.asarray(columna[:, inicio:inicio + meses_por_bloque], dtype=np.float64)
+        meses = slice(inicio, inicio + bloque.shape[1])
+        estadisticos[0, meses] = bloque.mean(axis=0)
+        estadisticos[1:, meses] = np.percentile(bloque, [5, 50, 95], axis=0)
+        cuantiles[:, meses] = np.quantile(bloque, _CUANTILES_WASSERSTEIN, axis=0)
+    return estadisticos, cuantiles
+
+
+def comparar_ejecuciones(lotes, columna="Total Mensual", referencia=None):
+    """
+    Compara varias ejecuciones alineándolas por mes.
+
+    Para cada ejecución se calculan la media y los percentiles 5/50/95 de
+    `columna` en cada mes; después, en una sola operación vectorizada sobre el
+    array (ejecuciones, estadísticos, meses), las diferencias respecto a la
+    ejecución de referencia y la distancia de Wasserstein-1 entre las
+    distribuciones de cada mes. Las ejecuciones más cortas se rellenan con NaN
+    y el resumen del periodo se calcula sobre los meses comunes a todas.
+
+    Args:
+        lotes (dict): nombre -> LoteOperacion (en memoria o mapeado).
+        columna (str): Columna del lote a comparar.
+        referencia (str): Nombre de la ejecución de referencia (por defecto, la primera).
+
+    Returns:
+        dict: "nombres", "meses", "estadisticos", "diferencias" (ejecuciones,
+        estadísticos, meses), "wasserstein" (ejecuciones, meses) y "totales"
+        (DataFrame resumen del periodo completo).
+    """
+    nombres = list(lotes)
+    referencia = nombres[0] if referencia is None else referencia
+    num_meses = max(lote.num_meses for lote in lotes.values())
+    meses_comunes = min(lote.num_meses for lote in lotes.values())
+
+    estadisticos = np.full((len(nombres), len(ESTADISTICOS_COMPARACION), num_meses), np.nan)
+    cuantiles = np.full((len(nombres), len(_CUANTILES_WASSERSTEIN), num_meses), np.nan)
+    cuantiles_totales = np.empty((len(nombres), len(_CUANTILES_WASSERSTEIN)))
+    medias_totales = np.empty(len(nombres))
+    for i, lote in enumerate(lotes.values()):
+        estadisticos[i, :, :lote.num_meses], cuantiles[i, :, :lote.num_meses] = _estadisticos_por_mes(lote[columna])
+        total_periodo = lote[columna][:, :meses_comunes].sum(axis=1, dtype=np.float64)
+        medias_totales[i] = total_periodo.mean()
+        cuantiles_totales[i] = np.quantile(total_periodo, _CUANTILES_WASSERSTEIN)
+
+    i_ref = nombres.index(referencia)
+    diferencias = estadisticos - estadisticos[i_ref]
+    wasserstein = np.abs(cuantiles - cuantiles[i_ref]).mean(axis=1)
+
+    totales = pd.DataFrame({
+        "Ejecución": nombres,
+        "Media periodo": medias_totales,
+        "P5 periodo": cuantiles_totales[:, 4],
+        "P95 periodo": cuantiles_totales[:, 94],
+        "Δ media vs referencia": medias_totales - medias_totales[i_ref],
+        "Wasserstein vs referencia": np.abs(cuantiles_totales - cuantiles_totales[i_ref]).mean(axis=1)
+    })
+
+    return {
+        "nombres": nombres,
+        "referencia": referencia,
+        "meses": np.arange(1, num_meses + 1),
+        "estadisticos": estadisticos,
+        "diferencias": diferencias,
+        "wasserstein": wasserstein,
+        "totales": totales,
+        "meses_comunes": meses_comunes
+    }
+
+# -------------------------------------------------
+# EXPORTACIÓN DE INFORMES (PARQUET / EXCEL / PDF)
+# -------------------------------------------------
+# Las exportaciones se escriben en disco por bloques desde un hilo en segundo
+# plano; en la sesión solo se guarda la ruta del fichero generado.
+DIRECTORIO_EXPORTACIONES = os.environ.get(
+    "FISIOFIND_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "fisiofind_exportaciones")
+)
+FILAS_POR_BLOQUE = 500000
+MAX_FILAS_HOJA_EXCEL = 1048576  # Límite de filas de una hoja (incluida la cabecera)
+# XlsxWriter escribe ~11.000 filas/s (una llamada por fila): por encima de este
+# tamaño (~25 s) el Excel solo lleva los percentiles por mes y el detalle va a Parquet
+MAX_FILAS_EXCEL_ESCENARIOS = 250000
+ANTIGUEDAD_MAXIMA_EXPORTACIONES = 24 * 3600  # Segundos que se conserva un fichero exportado
+SIMBOLOS_MONEDA = {"EUR": "€", "USD": "$"}
+COLUMNAS_MONETARIAS = [
+    "Chatbot", "Despliegue", "Mantenimiento Correctivo", "Mantenimiento Adaptativo",
+    "APIs", "Almacenamiento (GCP)", "Transferencia (GCP)", "Marketing", "Total Mensual",
+    "Ingresos Mensuales", "Costes Acumulados", "Ingresos Acumulados", "ROI"
+]
+
+MAX_EXPORTACIONES_SIMULTANEAS = 2
+
+
+@st.cache_resource
+def obtener_ejecutor_exportaciones():
+    """
+    Pool de hilos de las exportaciones, compartido por todas las sesiones y
+    reejecuciones del script (Streamlit vuelve a ejecutar el módulo en cada
+    interacción), de modo que el límite de exportaciones simultáneas es real.
+    """
+    return ThreadPoolExecutor(max_workers=MAX_EXPORTACIONES_SIMULTANEAS, thread_name_prefix="exportacion")
+
+
+def iterar_bloques_lote(lote, filas_por_bloque=FILAS_POR_BLOQUE):
+    """
+    Recorre un `LoteOperacion` en formato largo (una fila por escenario y mes)
+    en DataFrames de como mucho `filas_por_bloque` filas. Cada bloque son
+    vistas de las columnas del lote, no copias.
+    """
+    escenarios_por_bloque = max(1, filas_por_bloque // max(lote.num_meses, 1))
+    for inicio in range(0, lote.num_escenarios, escenarios_por_bloque):
+        fin = min(inicio + escenarios_por_bloque, lote.num_escenarios)
+        datos = {
+            "Escenario": np.repeat(np.arange(inicio, fin, dtype=np.int32), lote.num_meses),
+            "Mes": np.tile(lote.meses, fin - inicio)
+        }
+        datos.update({nombre: col[inicio:fin].ravel() for nombre, col in lote.columnas.items()})
+        yield pd.DataFrame(datos, copy=False)
+
+
+def percentiles_lote(lote):
+    """
+    Media y percentiles 5/50/95 de cada columna del lote, mes a mes: una fila
+    por mes y estadístico, en lugar de una por escenario y mes.
+    """
+    datos = {
+        "Mes": np.repeat(lote.meses, len(ESTADISTICOS_COMPARACION)),
+        "Estadístico": np.tile(ESTADISTICOS_COMPARACION, lote.num_meses)
+    }
+    for nombre, columna in lote.columnas.items():
+        estadisticos, _ = _estadisticos_por_mes(columna)
+        datos[nombre] = estadisticos.T.ravel()
+    return pd.DataFrame(datos)
+
+
+def _como_bloques(datos):
+    """
+    Acepta un DataFrame, una lista de registros o un iterable de DataFrames y
+    devuelve siempre un iterable de DataFrames.
+    """
+    if isinstance(datos, pd.DataFrame):
+        return [datos]
+    if isinstance(datos, list) and (not datos or isinstance(datos[0], dict)):
+        return [pd.DataFrame(datos)]
+    return datos
+
+
+def exportar_parquet(bloques, ruta):
+    """
+    Escribe los bloques en un fichero Parquet, un grupo de filas por bloque,
+    sin tener nunca más de un bloque en memoria.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as error:
+        raise ImportError("La exportación a Parquet necesita 'pyarrow' (pip install pyarrow).") from error
+
+    escritor = None
+    try:
+        for bloque in _como_bloques(bloques):
+            tabla = pa.Table.from_pandas(bloque, preserve_index=False)
+            if escritor is None:
+                escritor = pq.ParquetWriter(ruta, tabla.schema, compression="zstd")
+            escritor.write_table(tabla)
+    finally:
+        if escritor is not None:
+            escritor.close()
+    return ruta
+
+
+def exportar_excel(hojas, ruta, figuras=None):
+    """
+    Escribe un libro Excel en modo de memoria constante (las filas se vuelcan a
+    disco según se escriben).
+
+    Args:
+        hojas (dict): nombre de hoja -> DataFrame, lista de registros o iterable
+            de DataFrames (p.ej. `iterar_bloques_lote`). Si una hoja supera el
+            límite de filas de Excel, continúa en "nombre (2)", "nombre (3)"...
+        figuras (dict): nombre -> figura de matplotlib, insertadas como imagen
+            en la hoja "Gráficos".
+    """
+    try:
+        import xlsxwriter
+    except ImportError as error:
+        raise ImportError("La exportación a Excel necesita 'XlsxWriter' (pip install XlsxWriter).") from error
+
+    libro = xlsxwriter.Workbook(ruta, {"constant_memory": True, "nan_inf_to_errors": True})
+    formato_cabecera = libro.add_format({"bold": True, "bg_color": "#DDEBF7"})
+    formato_numero = libro.add_format({"num_format": "#,##0.00"})
+
+    try:
+        for nombre, datos in hojas.items():
+            hoja, fila, parte = None, 0, 1
+            for bloque in _como_bloques(datos):
+                columnas = list(bloque.columns)
+                # tolist() devuelve tipos nativos de Python, que XlsxWriter sabe escribir
+                valores = [bloque[c].tolist() for c in columnas]
+                for registro in zip(*valores):
+                    if hoja is None or fila >= MAX_FILAS_HOJA_EXCEL:
+                        hoja = libro.add_worksheet(nombre[:31] if parte == 1 else f"{nombre[:26]} ({parte})")
+                        hoja.set_column(0, len(columnas) - 1, 16, formato_numero)
+                        hoja.write_row(0, 0, columnas, formato_cabecera)
+                        hoja.freeze_panes(1, 0)
+                        fila, parte = 1, parte + 1
+                    hoja.write_row(fila, 0, registro)
+                    fila += 1
+
+        if figuras:
+            hoja_graficos = libro.add_worksheet("Gráficos")
+            fila = 0
+            for nombre, figura in figuras.items():
+                imagen = io.BytesIO()
+                figura.savefig(imagen, format="png", dpi=100, bbox_inches="tight")
+                hoja_graficos.write(fila, 0, nombre, formato_cabecera)
+                hoja_graficos.insert_image(fila + 1, 0, f"{nombre}.png", {"image_data": imagen})
+                fila += 32
+    finally:
+        libro.close()
+    return ruta
+
+
+def exportar_pdf(resumen, ruta, figuras=None, tablas=None):
+    """
+    Genera un informe PDF: una página de resumen con las métricas clave,
+    una página por gráfico y las tablas pequeñas (p.ej. el desglose de desarrollo).
+
+    Args:
+        resumen (dict): etiqueta -> valor ya formateado.
+        figuras (dict): título -> figura de matplotlib.
+        tablas (dict): título -> DataFrame (se recomiendan tablas de pocas filas).
+    """
+    from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.figure import Figure
+
+    with PdfPages(ruta) as pdf:
+        pagina = Figure(figsize=(8.27, 11.69))
+        pagina.text(0.08, 0.94, "FisioFind - Informe de Costes y ROI", fontsize=18, weight="bold")
+        for i, (etiqueta, valor) in enumerate(resumen.items()):
+            pagina.text(0.08, 0.88 - i * 0.035, f"{etiqueta}: {valor}", fontsize=11)
+        pdf.savefig(pagina)
+
+        for titulo, figura in (figuras or {}).items():
+            figura.suptitle(titulo)
+            pdf.savefig(figura, bbox_inches="tight")
+
+        for titulo, df_tabla in (tablas or {}).items():
+            pagina = Figure(figsize=(11.69, 8.27))
+            ax = pagina.add_subplot(111)
+            ax.axis("off")
+            ax.set_title(titulo)
+            celdas = [[f"{v:,.2f}" if isinstance(v, float) else v for v in fila] for fila in df_tabla.itertuples(index=False)]
+            tabla = ax.table(cellText=celdas, colLabels=list(df_tabla.columns), loc="center")
+            tabla.auto_set_font_size(False)
+            tabla.set_fontsize(7)
+            pdf.savefig(pagina, bbox_inches="tight")
+    return ruta
+
+
+def figura_desarrollo(desglose_desarrollo):
+    """
+    Gráfico de barras del coste de desarrollo por mes (sin usar pyplot, para
+    poder generarlo desde el hilo de exportación).
+    """
+    from matplotlib.figure import Figure
+
+    figura = Figure(figsize=(8, 4))
+    ax = figura.add_subplot(111)
+    ax.bar([fila["Mes"] for fila in desglose_desarrollo], [fila["Total Mes"] for fila in desglose_desarrollo], color="royalblue")
+    ax.set_ylabel("Euros")
+    ax.set_title("Costes de Desarrollo por Mes")
+    return figura
+
+
+def _con_moneda_en_cabecera(df, moneda):
+    """
+    Copia de `df` con la moneda añadida al nombre de las columnas de importes.
+    """
+    return df.rename(columns={c: f"{c} ({moneda})" for c in COLUMNAS_MONETARIAS if c in df.columns})
+
+
+def figura_roi(df_roi):
+    """
+    Gráfico de ingresos, costes acumulados y ROI (sin usar pyplot), en la
+    moneda del informe (`df_roi.attrs["moneda"]`, EUR por defecto).
+    """
+    from matplotlib.figure import Figure
+
+    figura = Figure(figsize=(10, 6))
+    ax = figura.add_subplot(111)
+    for columna in ["Ingresos Acumulados", "Costes Acumulados", "ROI"]:
+        ax.plot(df_roi["Mes"], df_roi[columna], label=columna, marker="o")
+    ax.axhline(y=0, color="r", linestyle="--", alpha=0.3)
+    ax.set_xlabel("Mes")
+    ax.set_ylabel(df_roi.attrs.get("moneda", "EUR"))
+    ax.set_title("Evolución de Ingresos, Costes y ROI")
+    ax.legend()
+    ax.grid(True, alpha=0.3)
+    return figura
+
+
+def figura_percentiles_lote(lote):
+    """
+    Percentiles 5, 50 y 95 del coste mensual de un lote Monte Carlo (sin usar pyplot).
+    """
+    from matplotlib.figure import Figure
+
+    percentiles = np.percentile(lote["Total Mensual"], [5, 50, 95], axis=0)
+    figura = Figure(figsize=(10, 5))
+    ax = figura.add_subplot(111)
+    ax.fill_between(lote["Mes"], percentiles[0], percentiles[2], alpha=0.3, label="P5 - P95")
+    ax.plot(lote["Mes"], percentiles[1], label="Mediana")
+    ax.set_xlabel("Mes")
+    ax.set_ylabel("Euros")
+    ax.set_title(f"Coste mensual en {lote.num_escenarios:,} escenarios")
+    ax.legend()
+    return figura
+
+
+def limpiar_exportaciones(antiguedad_maxima=ANTIGUEDAD_MAXIMA_EXPORTACIONES):
+    """
+    Elimina de DIRECTORIO_EXPORTACIONES los ficheros con más de
+    `antiguedad_maxima` segundos. Devuelve cuántos se han borrado.
+    """
+    if not os.path.isdir(DIRECTORIO_EXPORTACIONES):
+        return 0
+    limite = time.time() - antiguedad_maxima
+    borrados = 0
+    for nombre in os.listdir(DIRECTORIO_EXPORTACIONES):
+        ruta = os.path.join(DIRECTORIO_EXPORTACIONES, nombre)
+        try:
+            if os.path.isfile(ruta) and os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+                borrados += 1
+        except OSError:
+            continue
+    return borrados
+
+
+def generar_exportacion(formato, desglose_desarrollo=None, df_operacion=None, df_roi=None, lote=None, resumen=None):
+    """
+    Genera un fichero de exportación en DIRECTORIO_EXPORTACIONES y devuelve su ruta.
+
+    - "xlsx": una hoja por tabla disponible, los escenarios del lote por bloques
+      (o solo sus percentiles por mes si pasa de MAX_FILAS_EXCEL_ESCENARIOS
+      filas) y los gráficos como imágenes.
+    - "parquet": los escenarios del lote en formato largo (o, si no hay lote,
+      el desglose de operación).
+    - "pdf": resumen, gráficos y desglose de desarrollo.
+
+    Antes de escribir se borran las exportaciones caducadas (`limpiar_exportaciones`).
+    """
+    os.makedirs(DIRECTORIO_EXPORTACIONES, exist_ok=True)
+    limpiar_exportaciones()
+    ruta = os.path.join(
+        DIRECTORIO_EXPORTACIONES,
+        f"fisiofind_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.{formato}"
+    )
+
+    figuras = {}
+    if desglose_desarrollo:
+        figuras["Costes de Desarrollo"] = figura_desarrollo(desglose_desarrollo)
+    if df_roi is not None:
+        figuras["Ingresos, Costes y ROI"] = figura_roi(df_roi)
+    if lote is not None:
+        figuras["Dispersión del Coste Mensual"] = figura_percentiles_lote(lote)
+
+    if formato == "xlsx":
+        hojas = {}
+        if desglose_desarrollo:
+            hojas["Desarrollo"] = desglose_desarrollo
+        # Los costes de operación se simulan en EUR; el ROI va en la moneda del informe
+        if df_operacion is not None:
+            hojas["Operación"] = _con_moneda_en_cabecera(df_operacion, "EUR")
+        if df_roi is not None:
+            hojas["ROI"] = _con_moneda_en_cabecera(df_roi, df_roi.attrs.get("moneda", "EUR"))
+        if lote is not None:
+            if lote.num_escenarios * lote.num_meses > MAX_FILAS_EXCEL_ESCENARIOS:
+                hojas["Percentiles escenarios"] = percentiles_lote(lote)
+            else:
+                hojas["Escenarios"] = iterar_bloques_lote(lote)
+        return exportar_excel(hojas, ruta, figuras)
+
+    if formato == "parquet":
+        if lote is not None:
+            return exportar_parquet(iterar_bloques_lote(lote), ruta)
+        return exportar_parquet(df_operacion, ruta)
+
+    if formato == "pdf":
+        tablas = {"Desglose de Desarrollo": pd.DataFrame(desglose_desarrollo)} if desglose_desarrollo else None
+        return exportar_pdf(resumen or {}, ruta, figuras, tablas)
+
+    raise ValueError(f"Formato de exportación desconocido: '{formato}'")
+
+
+def lanzar_exportacion(formato, **datos):
+    """
+    Lanza `generar_exportacion` en un hilo en segundo plano y devuelve el Future.
+    """
+    return obtener_ejecutor_exportaciones().submit(generar_exportacion, formato, **datos)
+
+# -------------------------------------------------
+# SECCION COMPARACIÓN
+# -------------------------------------------------
+def mostrar_pestana_comparacion():
+    st.header("Comparación de Ejecuciones")
+    st.info("""
+    Guarda el desglose actual o el lote Monte Carlo de la pestaña de operación
+    y compara varias ejecuciones guardadas mes a mes (p.ej. Coldline vs Standard
+    o Plan 1 vs Plan 2) sin tener que repetir las simulaciones.
+    """)
+
+    # 1. Guardar la ejecución actual
+    st.subheader("💾 Guardar Ejecución Actual")
+    disponibles = {}
+    if st.session_state.get("df_operacion_resultado") is not None:
+        disponibles["Desglose individual"] = lambda: LoteOperacion.desde_dataframe(st.session_state["df_operacion_resultado"])
+    if st.session_state.get("lote_operacion") is not None:
+        disponibles["Lote Monte Carlo"] = lambda: st.session_state["lote_operacion"]
+
+    if disponibles:
+        col1, col2, col3 = st.columns([2, 2, 1])
+        with col1:
+            origen = st.selectbox("Resultado a guardar", list(disponibles))
+        with col2:
+            nombre = st.text_input("Nombre de la ejecución", value="")
+        with col3:
+            if st.button("Guardar", disabled=not nombre.strip()):
+                identificador = guardar_ejecucion(
+                    nombre.strip(), disponibles[origen]()
+                )
+                st.success(f"Ejecución guardada ({identificador})")
+    else:
+        st.warning("Genera un desglose o un lote Monte Carlo en la pestaña de operación para poder guardarlo.")
+
+    # 2. Selección de ejecuciones
+    st.subheader("🔀 Comparar")
+    df_ejecuciones = listar_ejecuciones()
+    if len(df_ejecuciones) < 2:
+        st.warning("Necesitas al menos dos ejecuciones guardadas para comparar.")
+        return
+    etiquetas = {
+        fila.id: f"{fila.nombre} · {fila.num_escenarios:,} esc. · {fila.num_meses} meses · {fila.fecha}"
+        for fila in df_ejecuciones.itertuples()
+    }
+    seleccion = st.multiselect("Ejecuciones", list(etiquetas), format_func=etiquetas.get)
+    if len(seleccion) < 2:
+        return
+
+    columnas_coste = [c for c in COLUMNAS_LOTE if c not in ("Fisios", "Clientes/fisio")]
+    col1, col2 = st.columns(2)
+    with col1:
+        columna = st.selectbox("Columna", columnas_coste, index=columnas_coste.index("Total Mensual"))
+    with col2:
+        referencia_id = st.selectbox("Referencia", seleccion, format_func=etiquetas.get)
+
+    # Los nombres pueden repetirse: se añade el final del id para distinguirlos
+    lotes = {}
+    for identificador in seleccion:
+        lote, meta = cargar_ejecucion(identificador)
+        lotes[f"{meta['nombre']} ({identificador[-6:]})"] = lote
+    nombres = list(lotes)
+    referencia = nombres[seleccion.index(referencia_id)]
+
+    comparacion = comparar_ejecuciones(lotes, columna, referencia)
+
+    # 3. Resultados
+    estadistico = st.radio("Estadístico", ESTADISTICOS_COMPARACION, index=2, horizontal=True)
+    i_est = ESTADISTICOS_COMPARACION.index(estadistico)
+    indice_meses = pd.Index(comparacion["meses"], name="Mes")
+
+    st.write(f"#### {columna} ({estadistico}) por mes")
+    st.line_chart(pd.DataFrame(comparacion["estadisticos"][:, i_est].T, index=indice_meses, columns=nombres))
+
+    st.write(f"#### Diferencia respecto a {referencia}")
+    st.dataframe(
+        pd.DataFrame(comparacion["diferencias"][:, i_est].T, index=indice_meses, columns=nombres)
+        .style.format("{:,.2f}", na_rep="—")
+    )
+
+    if any(lote.num_escenarios > 1 for lote in lotes.values()):
+        st.write("#### Diferencia de distribuciones (Wasserstein-1) por mes")
+        st.line_chart(pd.DataFrame(comparacion["wasserstein"].T, index=indice_meses, columns=nombres))
+
+    st.write(f"#### Resumen de los {comparacion['meses_comunes']} meses comunes")
+    st.dataframe(comparacion["totales"].style.format("{:,.2f}", subset=list(comparacion["totales"].columns[1:])))
+
+# -------------------------------------------------
+# SECCION EXPORTACIÓN
+# -------------------------------------------------
+def mostrar_pestana_exportacion():
+    st.header("Exportación de Informes")
+    st.info("""
+    Genera libros Excel, ficheros Parquet o un resumen en PDF con los resultados
+    de las pestañas anteriores. Los ficheros se escriben por bloques en segundo
+    plano, así que puedes seguir usando la aplicación mientras se generan.
+    """)
+
+    datos = {
+        "desglose_desarrollo": st.session_state.get("desglose_desarrollo"),
+        "df_operacion": st.session_state.get("df_operacion_resultado"),
+        "df_roi": st.session_state.get("df_roi"),
+        "lote": st.session_state.get("lote_operacion")
+    }
+    if datos["df_roi"] is not None:
+        # Todos los importes del resumen en la moneda con la que se calculó el ROI
+        df_roi = datos["df_roi"]
+        moneda = df_roi.attrs.get("moneda", "EUR")
+        simbolo = SIMBOLOS_MONEDA[moneda]
+        coste_desarrollo = df_roi.attrs.get("coste_desarrollo", st.session_state.get("coste_desarrollo", 0))
+        datos["resumen"] = {
+            "Moneda": moneda,
+            "Coste de desarrollo": f"{coste_desarrollo:,.2f}{simbolo}",
+            "Coste de operación total": f"{df_roi['Total Mensual'].sum():,.2f}{simbolo}",
+            "Ingresos totales": f"{df_roi['Ingresos Mensuales'].sum():,.2f}{simbolo}",
+            "ROI final": f"{df_roi['ROI'].iloc[-1]:,.2f}{simbolo}",
+            "Meses analizados": len(df_roi)
+        }
+
+    # 1. Contenido disponible
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Desglose de desarrollo", "✅" if datos["desglose_desarrollo"] else "—")
+    col2.metric("Desglose de operación", "✅" if datos["df_operacion"] is not None else "—")
+    col3.metric("Tabla de ROI", "✅" if datos["df_roi"] is not None else "—")
+    col4.metric(
+        "Escenarios Monte Carlo",
+        f"{datos['lote'].num_escenarios * datos['lote'].num_meses:,} filas" if datos["lote"] is not None else "—"
+    )
+    if datos["lote"] is not None and datos["lote"].num_escenarios * datos["lote"].num_meses > MAX_FILAS_EXCEL_ESCENARIOS:
+        st.info(
+            f"El lote supera {MAX_FILAS_EXCEL_ESCENARIOS:,} filas: el Excel solo incluirá la media y los "
+            "percentiles por mes de los escenarios. Para el detalle completo, genera el Parquet."
+        )
+
+    # 2. Lanzar exportaciones
+    exportaciones = st.session_state.setdefault("exportaciones", {})
+    col1, col2, col3 = st.columns(3)
+    for col, formato, etiqueta in [(col1, "xlsx", "Generar Excel"), (col2, "parquet", "Generar Parquet"), (col3, "pdf", "Generar PDF")]:
+        with col:
+            if st.button(etiqueta, disabled=datos["df_operacion"] is None and datos["lote"] is None):
+                anterior = exportaciones.get(formato)
+                if anterior is not None and anterior.done() and anterior.exception() is None:
+                    try:
+                        os.remove(anterior.result())
+                    except OSError:
+                        pass
+                exportaciones[formato] = lanzar_exportacion(formato, **datos)
+
+    # 3. Estado y descargas. Solo se guarda la ruta: el fichero se lee del disco
+    # únicamente en la ejecución en la que el usuario pide descargarlo, para no
+    # cargar cada informe en memoria en todas las interacciones.
+    tipos_mime = {
+        "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "parquet": "application/vnd.apache.parquet",
+        "pdf": "application/pdf"
+    }
+    pendientes = False
+    for formato, futuro in exportaciones.items():
+        if not futuro.done():
+            st.info(f"⏳ Generando {formato.upper()}...")
+            pendientes = True
+        elif futuro.exception() is not None:
+            st.error(f"Error al generar {formato.upper()}: {futuro.exception()}")
+        else:
+            ruta = futuro.result()
+            if not os.path.isfile(ruta):
+                st.warning(f"El {formato.upper()} generado ha caducado; vuelve a generarlo.")
+                continue
+            etiqueta = f"{formato.upper()} ({os.path.getsize(ruta) / 1024**2:,.1f} MB)"
+            if st.button(f"📦 Preparar descarga {etiqueta}", key=f"preparar_{formato}"):
+                with open(ruta, "rb") as fichero:
+                    st.download_button(
+                        f"⬇️ Descargar {etiqueta}",
+                        data=fichero,
+                        file_name=os.path.basename(ruta),
+                        mime=tipos_mime[formato],
+                        key=f"descarga_{formato}"
+                    )
+    if pendientes:
+        st.button("🔄 Actualizar estado")
+
 # -------------------------------------------------
 # APLICACIÓN PRINCIPAL (STREAMLIT)
 # -------------------------------------------------
@@ -717,10 +3322,13 @@ def main():
     st.title("📊 Análisis de Costes y ROI - FisioFind")
 
     # Pestañas
-    tab1, tab2, tab3 = st.tabs([
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
         "💰 Costes Iniciales",
         "⚙️ Costes de Operación",
-        "📈 Proyección y ROI"
+        "📈 Proyección y ROI",
+        "🧭 Optimización",
+        "🔀 Comparación",
+        "📤 Exportación"
     ])
     
     # -----------------------------
@@ -869,6 +3477,7 @@ def main():
         
         # Guardamos en sesión el coste de desarrollo para utilizarlo en la pestaña de ROI
         st.session_state["coste_desarrollo"] = resultados_desarrollo["coste_total"]
+        st.session_state["desglose_desarrollo"] = resultados_desarrollo["desglose_detallado"]
     
 
     # -----------------------------
@@ -887,6 +3496,24 @@ def main():
     with tab3:
         mostrar_pestana_proyeccion_y_roi()
 
+    # -----------------------------
+    # PESTAÑA 4: Optimización
+    # -----------------------------
+    with tab4:
+        mostrar_pestana_optimizacion()
+
+    # -----------------------------
+    # PESTAÑA 5: Comparación
+    # -----------------------------
+    with tab5:
+        mostrar_pestana_comparacion()
+
+    # -----------------------------
+    # PESTAÑA 6: Exportación
+    # -----------------------------
+    with tab6:
+        mostrar_pestana_exportacion()
+
 # -------------------------------------------------
 # EJECUCIÓN
 # -------------------------------------------------
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# calc.py vive en la raíz del repositorio, fuera de cualquier paquete
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
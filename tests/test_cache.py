@@ -0,0 +1,124 @@
+"""
+Huellas de ejecución y caché en disco: entradas equivalentes dan la misma
+huella, las ejecuciones sin semilla no pasan por la caché, un acierto devuelve
+el mismo resultado y la limpieza expulsa primero lo menos usado.
+"""
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import calc
+from calc import (
+    _argumentos_completos,
+    _ruta_cache,
+    calcular_costes_operacion_simulacion,
+    calcular_huella,
+    cargar_resultado_cache,
+    guardar_resultado_cache,
+    limpiar_cache,
+    simular_operacion_reproducible
+)
+
+PARAMETROS = dict(
+    fisios_inicial=100,
+    fisios_final=300,
+    clientes_inicial=10,
+    clientes_final=20,
+    basic_videos=10,
+    premium_videos=15,
+    porcentaje_premium=30,
+    porcentaje_consumo=70,
+    tipo_almacenamiento="Standard",
+    incidencias_iniciales=10,
+    decremento_incidencias=1,
+    modo_mantenimiento_adaptativo="prorrateado",
+    chatbot_plan="plan1",
+    coste_apis_anual=1500,
+    num_meses=6
+)
+
+
+def huella(parametros, semilla=7):
+    return calcular_huella(_argumentos_completos(calcular_costes_operacion_simulacion, parametros), semilla)
+
+
+@pytest.fixture(autouse=True)
+def directorio_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(calc, "DIRECTORIO_CACHE", str(tmp_path))
+    return tmp_path
+
+
+def ficheros_cache(directorio):
+    return sorted(
+        os.path.join(raiz, nombre)
+        for raiz, _, ficheros in os.walk(directorio)
+        for nombre in ficheros
+    )
+
+
+def test_huella_igual_con_valores_por_defecto_explicitos():
+    explicitos = dict(PARAMETROS, ruido_factor=0.1, peticiones_chatbot_cliente=0.0, peticiones_apis_cliente=0.0)
+    assert huella(PARAMETROS) == huella(explicitos)
+
+
+def test_huella_igual_con_enteros_y_decimales():
+    decimales = dict(PARAMETROS, fisios_inicial=100.0, coste_apis_anual=np.int64(1500), porcentaje_premium=np.float32(30))
+    assert huella(PARAMETROS) == huella(decimales)
+    assert huella(PARAMETROS, semilla=7) == huella(PARAMETROS, semilla=7.0)
+
+
+def test_huella_distinta_con_otros_parametros_o_semilla():
+    assert huella(PARAMETROS) != huella(dict(PARAMETROS, fisios_final=301))
+    assert huella(PARAMETROS) != huella(dict(PARAMETROS, ruido_factor=0.2))
+    assert huella(PARAMETROS, semilla=7) != huella(PARAMETROS, semilla=8)
+
+
+def test_sin_semilla_no_usa_la_cache(directorio_cache):
+    df_1 = simular_operacion_reproducible(None, **PARAMETROS)
+    df_2 = simular_operacion_reproducible(None, **PARAMETROS)
+    assert df_1.attrs["semilla"] != df_2.attrs["semilla"]
+    assert df_1.attrs["huella"] != df_2.attrs["huella"]
+    assert ficheros_cache(directorio_cache) == []
+
+
+def test_acierto_de_cache_devuelve_el_mismo_resultado(directorio_cache, monkeypatch):
+    df_1 = simular_operacion_reproducible(7, **PARAMETROS)
+    assert ficheros_cache(directorio_cache) == [_ruta_cache(df_1.attrs["huella"])]
+
+    # Un acierto no debe volver a simular
+    @functools.wraps(calcular_costes_operacion_simulacion)
+    def no_simular(*args, **kwargs):
+        raise AssertionError("se ha vuelto a simular")
+    monkeypatch.setattr(calc, "calcular_costes_operacion_simulacion", no_simular)
+
+    df_2 = simular_operacion_reproducible(7, **dict(PARAMETROS, fisios_inicial=100.0, ruido_factor=0.1))
+    assert df_2.attrs == df_1.attrs
+    pd.testing.assert_frame_equal(df_2, df_1)
+
+
+def test_entrada_ilegible_es_un_fallo_y_se_elimina():
+    ruta = _ruta_cache("ab" * 32)
+    os.makedirs(os.path.dirname(ruta))
+    with open(ruta, "wb") as fichero:
+        fichero.write(b"\x80\x04\x95truncado")
+    assert cargar_resultado_cache("ab" * 32) is None
+    assert not os.path.exists(ruta)
+
+
+def test_limpiar_cache_expulsa_lo_menos_usado(directorio_cache):
+    df = pd.DataFrame({"valor": np.arange(1000.0)})
+    huellas = [f"{i:02d}" * 32 for i in range(3)]
+    for antiguedad, huella_entrada in zip([300, 200, 100], huellas):
+        guardar_resultado_cache(huella_entrada, df)
+        instante = os.path.getmtime(_ruta_cache(huella_entrada)) - antiguedad
+        os.utime(_ruta_cache(huella_entrada), (instante, instante))
+
+    # Leer la más antigua la convierte en la más reciente
+    assert cargar_resultado_cache(huellas[0]) is not None
+    tamanio_entrada = os.path.getsize(_ruta_cache(huellas[0]))
+    limpiar_cache(tamanio_maximo=2 * tamanio_entrada)
+
+    assert ficheros_cache(directorio_cache) == sorted([_ruta_cache(huellas[0]), _ruta_cache(huellas[2])])
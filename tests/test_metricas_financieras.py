@@ -0,0 +1,120 @@
+"""
+Comprobaciones de VAN, TIR y payback descontado: casos con solución cerrada,
+coherencia entre métricas y equivalencia del cálculo por lotes con el de un
+escenario cada vez.
+"""
+import numpy as np
+import pytest
+
+from calc import (
+    TASAS_DESCUENTO,
+    calcular_flujos_caja,
+    calcular_payback_descontado,
+    calcular_tir,
+    calcular_van
+)
+
+
+def flujos_anualidad(inversion, cuota, num_meses):
+    """Inversión en t=0 y una cuota constante al final de cada mes."""
+    return calcular_flujos_caja(np.full(num_meses, cuota), np.zeros(num_meses), inversion)
+
+
+def valor_actual_anualidad(cuota, num_meses, tasa_mensual):
+    return cuota * (1 - (1 + tasa_mensual) ** -num_meses) / tasa_mensual
+
+
+@pytest.fixture(scope="module")
+def flujos_aleatorios():
+    rng = np.random.default_rng(0)
+    ingresos = rng.uniform(0, 2500, (200, 36))
+    costes = rng.uniform(0, 1500, (200, 36))
+    return calcular_flujos_caja(ingresos, costes, rng.uniform(5000, 30000, (200, 1)))
+
+
+def test_van_anualidad_coincide_con_formula_cerrada():
+    flujos = flujos_anualidad(10000.0, 500.0, 36)
+    van = calcular_van(flujos, TASAS_DESCUENTO)
+    esperado = [
+        -10000.0 + valor_actual_anualidad(500.0, 36, (1 + tasa) ** (1 / 12) - 1)
+        for tasa in TASAS_DESCUENTO
+    ]
+    np.testing.assert_allclose(van, esperado, rtol=1e-12)
+
+
+def test_tir_anualidad_coincide_con_tasa_de_construccion():
+    # Inversión igual al valor actual de la anualidad al 1% mensual => TIR = 1.01^12 - 1
+    inversion = valor_actual_anualidad(500.0, 36, 0.01)
+    tir = calcular_tir(flujos_anualidad(inversion, 500.0, 36))
+    assert tir == pytest.approx(1.01 ** 12 - 1, rel=1e-8)
+
+
+@pytest.mark.parametrize("tasa_anual", [0.0, 0.05, 0.10, 0.15])
+def test_payback_anualidad_coincide_con_formula_cerrada(tasa_anual):
+    inversion, cuota, num_meses = 10150.0, 500.0, 60
+    tasa_mensual = (1 + tasa_anual) ** (1 / 12) - 1
+    if tasa_mensual == 0:
+        esperado = np.ceil(inversion / cuota)
+    else:
+        esperado = np.ceil(-np.log(1 - inversion * tasa_mensual / cuota) / np.log(1 + tasa_mensual))
+    assert calcular_payback_descontado(flujos_anualidad(inversion, cuota, num_meses), tasa_anual) == esperado
+
+
+def test_van_en_la_tir_es_cero(flujos_aleatorios):
+    # Con flujos netos de signo variable no todos los escenarios tienen TIR en el intervalo
+    tir = calcular_tir(flujos_aleatorios)
+    con_tir = np.isfinite(tir)
+    assert con_tir.mean() > 0.5
+    flujos = flujos_aleatorios[con_tir]
+    van_en_tir = np.array([calcular_van(f, [t])[0] for f, t in zip(flujos, tir[con_tir])])
+    escala = np.abs(flujos).sum(axis=1)
+    assert np.all(np.abs(van_en_tir) <= 1e-8 * escala)
+
+
+def test_lote_equivale_a_escenario_por_escenario(flujos_aleatorios):
+    np.testing.assert_allclose(
+        calcular_van(flujos_aleatorios, TASAS_DESCUENTO),
+        np.array([calcular_van(f, TASAS_DESCUENTO) for f in flujos_aleatorios]),
+        rtol=1e-12
+    )
+    np.testing.assert_allclose(
+        calcular_tir(flujos_aleatorios),
+        np.array([calcular_tir(f) for f in flujos_aleatorios]),
+        rtol=1e-9
+    )
+    np.testing.assert_array_equal(
+        calcular_payback_descontado(flujos_aleatorios, 0.10),
+        np.array([calcular_payback_descontado(f, 0.10) for f in flujos_aleatorios])
+    )
+
+
+@pytest.mark.parametrize("flujos", [
+    [-100.0, 200.0, 10.0],        # TIR mensual ~105%: por encima del intervalo inicial
+    [-1000.0] + [1500.0] * 36
+])
+def test_tir_por_encima_de_tasa_max_amplia_el_intervalo(flujos):
+    tir = calcular_tir(flujos)
+    assert np.isfinite(tir) and (1 + tir) ** (1 / 12) - 1 > 1.0
+    assert abs(calcular_van(np.asarray(flujos), [tir])[0]) <= 1e-8 * np.abs(flujos).sum()
+
+
+def test_tir_del_ejemplo_coincide_con_formula_cerrada():
+    # -100 + 200 x + 10 x^2 = 0 con x = 1 / (1 + r)
+    x = (-200 + np.sqrt(200 ** 2 + 4 * 10 * 100)) / (2 * 10)
+    assert calcular_tir([-100.0, 200.0, 10.0]) == pytest.approx((1 / x) ** 12 - 1, rel=1e-8)
+
+
+@pytest.mark.parametrize("flujos", [
+    [-10000.0] + [-100.0] * 24,   # Nunca hay flujos positivos
+    [0.0] + [100.0] * 24,         # No hay inversión que recuperar
+    [-10000.0] * 25               # Todo pérdidas
+])
+def test_sin_raiz_devuelve_nan(flujos):
+    assert np.isnan(calcular_tir(flujos))
+
+
+def test_sin_recuperacion_payback_nan_y_tir_negativa():
+    # 24 cuotas de 100 no recuperan 10000: no hay payback y la TIR es negativa
+    flujos = flujos_anualidad(10000.0, 100.0, 24)
+    assert np.isnan(calcular_payback_descontado(flujos, 0.10))
+    assert calcular_tir(flujos) < 0
@@ -0,0 +1,375 @@
+"""
+Equivalencia numérica del motor de cálculo.
+
+Los escenarios de referencia de este módulo (semilla fija) deben reproducir los
+desgloses guardados en referencia/resultados_referencia.json dentro de las
+tolerancias, y todos los resultados deben cumplir sus invariantes.
+
+    python -m pytest tests                       -> comprueba
+    python -m tests.test_referencia regenerar    -> guarda la referencia actual
+"""
+import json
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+from calc import (
+    OPCIONES_ALMACENAMIENTO,
+    OPCIONES_CHATBOT,
+    OPCIONES_MANTENIMIENTO,
+    VERSION_MOTOR,
+    _normalizar_parametro,
+    calcular_costes_desarrollo,
+    calcular_costes_operacion_simulacion,
+    calcular_roi,
+    coste_operacion_lote,
+    expandir_parametros
+)
+
+RUTA_REFERENCIA = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "referencia", "resultados_referencia.json"
+)
+TOLERANCIA_RELATIVA = 1e-9
+TOLERANCIA_ABSOLUTA = 1e-6
+NUM_CASOS_ALEATORIOS = 50
+
+
+# Escenarios con semilla fija cuyos desgloses completos se guardan en
+# referencia/resultados_referencia.json. Cualquier cambio de rendimiento en el
+# cálculo debe seguir reproduciéndolos.
+_PARAMETROS_OPERACION_BASE = dict(
+    fisios_inicial=100,
+    fisios_final=700,
+    clientes_inicial=10,
+    clientes_final=30,
+    basic_videos=10,
+    premium_videos=15,
+    porcentaje_premium=30,
+    porcentaje_consumo=70,
+    tipo_almacenamiento="Standard",
+    incidencias_iniciales=10,
+    decremento_incidencias=1,
+    modo_mantenimiento_adaptativo="prorrateado",
+    chatbot_plan="plan1",
+    coste_apis_anual=1500,
+    num_meses=24,
+    ruido_factor=0.3,
+    peticiones_chatbot_cliente=1.0,
+    peticiones_apis_cliente=2.0
+)
+
+ESCENARIOS_DESARROLLO = {
+    "horas_estimadas": dict(usar_horas_reales=False),
+    "horas_reales": dict(
+        usar_horas_reales=True,
+        horas_reales={"febrero": 40, "marzo": 52, "abril": 30, "mayo": 36}
+    ),
+    "sin_marketing": dict(usar_horas_reales=False, marketing_horas=0)
+}
+
+ESCENARIOS_OPERACION = {
+    "base_plan1_standard": dict(semilla=42, **_PARAMETROS_OPERACION_BASE),
+    "plan2_coldline_trimestral": dict(
+        _PARAMETROS_OPERACION_BASE,
+        semilla=7,
+        chatbot_plan="plan2",
+        tipo_almacenamiento="Coldline",
+        modo_mantenimiento_adaptativo="trimestral",
+        num_meses=36,
+        peticiones_chatbot_cliente=3.0,
+        peticiones_apis_cliente=10.0,
+        tipo_cambio_usd_eur=list(np.linspace(0.88, 0.95, 36))
+    ),
+    "un_mes_sin_uso": dict(
+        _PARAMETROS_OPERACION_BASE,
+        semilla=1,
+        num_meses=1,
+        peticiones_chatbot_cliente=0.0,
+        peticiones_apis_cliente=0.0
+    ),
+    "sin_fisios": dict(_PARAMETROS_OPERACION_BASE, semilla=3, fisios_inicial=0, fisios_final=0, num_meses=12),
+    "calendarios_variables": dict(
+        _PARAMETROS_OPERACION_BASE,
+        semilla=11,
+        porcentaje_premium={"tipo": "rampa", "inicial": 10, "final": 50, "mes_inicio": 3, "mes_fin": 18},
+        porcentaje_consumo={"tipo": "escalon", "inicial": 60, "cambios": {6: 75, 12: 85}},
+        coste_apis_anual={"tipo": "escalon", "inicial": 1500, "cambios": {13: 2400}},
+        marketing_horas=[40, 40, 40, 15],
+        peticiones_chatbot_cliente={"tipo": "rampa", "inicial": 0.5, "final": 3.0, "mes_inicio": 1, "mes_fin": 24}
+    ),
+    "opciones_variables": dict(
+        _PARAMETROS_OPERACION_BASE,
+        semilla=13,
+        tipo_almacenamiento={"tipo": "escalon", "inicial": "Standard", "cambios": {7: "Nearline", 19: "Coldline"}},
+        chatbot_plan={"tipo": "escalon", "inicial": "plan1", "cambios": {10: "plan2"}},
+        modo_mantenimiento_adaptativo=["trimestral"] * 12 + ["prorrateado"],
+        marketing_tarifa={"tipo": "rampa", "inicial": 25.0, "final": 35.0, "mes_inicio": 6, "mes_fin": 18},
+        peticiones_chatbot_cliente=2.0
+    )
+}
+
+# Precios con los que se calcula el ROI de cada escenario de operación
+PRECIOS_REFERENCIA = dict(precio_standard=17.99, precio_premium=24.99, porcentaje_premium=30)
+
+
+def generar_resultados_referencia():
+    """
+    Ejecuta todos los escenarios de referencia con la implementación actual.
+
+    Returns:
+        dict: {"desarrollo": {...}, "operacion": {...}, "roi": {...}} con los
+        desgloses en forma de listas de registros, más la versión del motor.
+    """
+    resultados = {"version_motor": VERSION_MOTOR, "desarrollo": {}, "operacion": {}, "roi": {}}
+
+    for nombre, parametros in ESCENARIOS_DESARROLLO.items():
+        desarrollo = calcular_costes_desarrollo(**parametros)
+        resultados["desarrollo"][nombre] = {
+            "coste_total": desarrollo["coste_total"],
+            "desglose": desarrollo["desglose_detallado"]
+        }
+
+    coste_desarrollo = resultados["desarrollo"]["horas_estimadas"]["coste_total"]
+    for nombre, parametros in ESCENARIOS_OPERACION.items():
+        df_operacion = calcular_costes_operacion_simulacion(**parametros)
+        df_roi, mes_equilibrio = calcular_roi(df_operacion, coste_desarrollo, **PRECIOS_REFERENCIA)
+        resultados["operacion"][nombre] = df_operacion.to_dict("records")
+        resultados["roi"][nombre] = {
+            "mes_equilibrio": None if mes_equilibrio is None else int(mes_equilibrio),
+            "desglose": df_roi[["Mes", "Ingresos Mensuales", "Costes Acumulados", "Ingresos Acumulados", "ROI"]].to_dict("records")
+        }
+
+    return _normalizar_parametro(resultados)
+
+
+def guardar_resultados_referencia(ruta=RUTA_REFERENCIA):
+    """
+    Regenera el fichero de referencia. Solo debe hacerse cuando un cambio de
+    resultados es intencionado (y en ese caso, subiendo VERSION_MOTOR).
+    """
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta, "w", encoding="utf-8") as fichero:
+        json.dump(generar_resultados_referencia(), fichero, indent=1, ensure_ascii=False, sort_keys=True)
+        fichero.write("\n")
+
+
+def comparar_con_referencia(resultados, referencia, ruta="", rtol=TOLERANCIA_RELATIVA, atol=TOLERANCIA_ABSOLUTA):
+    """
+    Compara recursivamente dos resultados (dicts, listas y números) y devuelve
+    la lista de diferencias encontradas como textos "ruta: obtenido != esperado".
+    """
+    if isinstance(referencia, dict) and isinstance(resultados, dict):
+        diferencias = []
+        for clave in sorted(set(referencia) | set(resultados)):
+            if clave not in resultados or clave not in referencia:
+                diferencias.append(f"{ruta}/{clave}: clave presente solo en uno de los resultados")
+                continue
+            diferencias += comparar_con_referencia(resultados[clave], referencia[clave], f"{ruta}/{clave}", rtol, atol)
+        return diferencias
+
+    if isinstance(referencia, list) and isinstance(resultados, list):
+        if len(referencia) != len(resultados):
+            return [f"{ruta}: longitud {len(resultados)} != {len(referencia)}"]
+        diferencias = []
+        for i, (obtenido, esperado) in enumerate(zip(resultados, referencia)):
+            diferencias += comparar_con_referencia(obtenido, esperado, f"{ruta}[{i}]", rtol, atol)
+        return diferencias
+
+    numericos = (int, float)
+    if isinstance(referencia, numericos) and isinstance(resultados, numericos) and not isinstance(referencia, bool):
+        if np.isclose(resultados, referencia, rtol=rtol, atol=atol):
+            return []
+    elif resultados == referencia:
+        return []
+    return [f"{ruta}: {resultados!r} != {referencia!r}"]
+
+
+def verificar_propiedades_desarrollo(desarrollo):
+    """
+    Comprueba las invariantes del desglose de desarrollo. Devuelve los fallos.
+    """
+    fallos = []
+    for fila in desarrollo["desglose_detallado"]:
+        componentes = (
+            fila["Coste Personal"] + fila["Hardware"] + fila["GitHub"] +
+            fila["Preproducción"] + fila["Marketing"]
+        )
+        if not np.isclose(fila["Subtotal"], componentes, rtol=TOLERANCIA_RELATIVA, atol=TOLERANCIA_ABSOLUTA):
+            fallos.append(f"{fila['Mes']}: el subtotal no es la suma de sus componentes")
+        if fila["Contingencia (10%)"] != fila["Subtotal"] * 0.1:
+            fallos.append(f"{fila['Mes']}: la contingencia no es exactamente el 10% del subtotal")
+        if fila["Total Mes"] != fila["Subtotal"] + fila["Contingencia (10%)"]:
+            fallos.append(f"{fila['Mes']}: el total no es subtotal + contingencia")
+    if not np.isclose(desarrollo["coste_total"], sum(desarrollo["costes_mensuales"].values()), rtol=TOLERANCIA_RELATIVA):
+        fallos.append("el coste total no es la suma de los meses")
+    return fallos
+
+
+def verificar_propiedades_operacion(df_operacion, df_roi=None, coste_desarrollo=0.0):
+    """
+    Comprueba las invariantes del desglose de operación (y del ROI si se da).
+    Devuelve los fallos.
+    """
+    fallos = []
+    componentes = [
+        "Chatbot", "Despliegue", "Mantenimiento Correctivo", "Mantenimiento Adaptativo",
+        "APIs", "Almacenamiento (GCP)", "Transferencia (GCP)", "Marketing"
+    ]
+    suma = df_operacion[componentes].sum(axis=1)
+    if not np.allclose(df_operacion["Total Mensual"], suma, rtol=TOLERANCIA_RELATIVA, atol=TOLERANCIA_ABSOLUTA):
+        fallos.append("el total mensual no es la suma de sus componentes")
+    if (df_operacion[componentes] < 0).any().any():
+        fallos.append("hay costes negativos")
+    if (df_operacion["Mantenimiento Correctivo"] < 27).any():
+        fallos.append("el mantenimiento correctivo baja de 1 incidencia (27€)")
+    if (df_operacion[["Fisios", "Clientes/fisio"]] < 0).any().any():
+        fallos.append("hay fisios o clientes negativos")
+
+    if df_roi is not None:
+        if not np.allclose(df_roi["ROI"], df_roi["Ingresos Acumulados"] - df_roi["Costes Acumulados"]):
+            fallos.append("el ROI no es ingresos acumulados - costes acumulados")
+        if not np.allclose(df_roi["Costes Acumulados"].diff().iloc[1:], df_roi["Total Mensual"].iloc[1:]):
+            fallos.append("los costes acumulados no crecen con el total mensual")
+        if not np.isclose(df_roi["Costes Acumulados"].iloc[0], coste_desarrollo + df_roi["Total Mensual"].iloc[0]):
+            fallos.append("los costes acumulados no parten de la inversión inicial")
+    return fallos
+
+
+def verificar_motor_lote(df_operacion, parametros):
+    """
+    Comprueba que el motor vectorizado (`coste_operacion_lote`) reproduce la
+    implementación de referencia mes a mes sobre la misma trayectoria.
+    """
+    parametros = expandir_parametros(parametros, len(df_operacion))
+    costes = coste_operacion_lote(
+        df_operacion["Fisios"].to_numpy()[np.newaxis],
+        df_operacion["Clientes/fisio"].to_numpy()[np.newaxis],
+        basic_videos=parametros["basic_videos"],
+        premium_videos=parametros["premium_videos"],
+        porcentaje_premium=parametros["porcentaje_premium"],
+        porcentaje_consumo=parametros["porcentaje_consumo"],
+        tipo_almacenamiento=parametros["tipo_almacenamiento"],
+        incidencias_iniciales=parametros["incidencias_iniciales"],
+        decremento_incidencias=parametros["decremento_incidencias"],
+        modo_mantenimiento_adaptativo=parametros["modo_mantenimiento_adaptativo"],
+        chatbot_plan=parametros["chatbot_plan"],
+        coste_apis_mensual=parametros["coste_apis_anual"] / 12.0,
+        marketing_horas=parametros.get("marketing_horas", 15),
+        marketing_tarifa=parametros.get("marketing_tarifa", 25.0),
+        peticiones_chatbot_cliente=parametros["peticiones_chatbot_cliente"],
+        peticiones_apis_cliente=parametros["peticiones_apis_cliente"],
+        tipo_cambio_usd_eur=df_operacion["Tipo de cambio USD/EUR"].to_numpy()[np.newaxis]
+    )
+    return [
+        f"motor por lotes: la columna '{nombre}' difiere de la referencia"
+        for nombre, valores in costes.items()
+        if not np.allclose(valores[0], df_operacion[nombre], rtol=TOLERANCIA_RELATIVA, atol=TOLERANCIA_ABSOLUTA)
+    ]
+
+
+def generar_caso_aleatorio(caso):
+    """
+    Parámetros aleatorios (con semilla `caso`) para la comprobación basada en
+    propiedades: un desarrollo, una operación y unos precios.
+    """
+    rng = random.Random(caso)
+    desarrollo = calcular_costes_desarrollo(
+        usar_horas_reales=True,
+        horas_reales={mes: rng.randint(0, 100) for mes in ["febrero", "marzo", "abril", "mayo"]},
+        marketing_horas=rng.randint(0, 60),
+        marketing_tarifa=rng.uniform(0, 60)
+    )
+    fisios_inicial = rng.randint(0, 2000)
+    clientes_inicial = rng.randint(0, 100)
+    parametros = dict(
+        fisios_inicial=fisios_inicial,
+        fisios_final=fisios_inicial + rng.randint(-fisios_inicial, 5000),
+        clientes_inicial=clientes_inicial,
+        clientes_final=clientes_inicial + rng.randint(-clientes_inicial, 200),
+        basic_videos=rng.randint(1, 500),
+        premium_videos=rng.randint(1, 500),
+        porcentaje_premium=rng.randint(0, 100),
+        porcentaje_consumo=rng.randint(0, 100),
+        tipo_almacenamiento=rng.choice(OPCIONES_ALMACENAMIENTO),
+        incidencias_iniciales=rng.randint(0, 100),
+        decremento_incidencias=rng.randint(0, 10),
+        modo_mantenimiento_adaptativo=rng.choice(OPCIONES_MANTENIMIENTO),
+        chatbot_plan=rng.choice(OPCIONES_CHATBOT),
+        coste_apis_anual=rng.uniform(100, 100000),
+        num_meses=rng.randint(1, 60),
+        ruido_factor=rng.uniform(0, 0.5),
+        peticiones_chatbot_cliente=rng.uniform(0, 20),
+        peticiones_apis_cliente=rng.uniform(0, 20),
+        tipo_cambio_usd_eur=rng.uniform(0.7, 1.2),
+        marketing_horas={
+            "tipo": "rampa",
+            "inicial": rng.randint(0, 60),
+            "final": rng.randint(0, 60),
+            "mes_inicio": rng.randint(1, 60),
+            "mes_fin": rng.randint(1, 60)
+        }
+    )
+    precios = dict(
+        precio_standard=rng.uniform(0, 100),
+        precio_premium=rng.uniform(0, 100),
+        porcentaje_premium=rng.randint(0, 100)
+    )
+    return desarrollo, parametros, precios
+
+
+@pytest.fixture(scope="module")
+def referencia():
+    with open(RUTA_REFERENCIA, encoding="utf-8") as fichero:
+        return json.load(fichero)
+
+
+def test_version_motor_de_la_referencia(referencia):
+    assert referencia.get("version_motor") == VERSION_MOTOR, (
+        "La referencia es de otra versión del motor: regenérala solo si el cambio de resultados es intencionado"
+    )
+
+
+def test_resultados_coinciden_con_referencia(referencia):
+    resultados = generar_resultados_referencia()
+    diferencias = comparar_con_referencia(
+        {k: v for k, v in resultados.items() if k != "version_motor"},
+        {k: v for k, v in referencia.items() if k != "version_motor"}
+    )
+    assert not diferencias, "\n".join(diferencias[:50])
+
+
+@pytest.mark.parametrize("nombre", list(ESCENARIOS_DESARROLLO))
+def test_propiedades_desarrollo(nombre):
+    assert verificar_propiedades_desarrollo(calcular_costes_desarrollo(**ESCENARIOS_DESARROLLO[nombre])) == []
+
+
+@pytest.mark.parametrize("nombre", list(ESCENARIOS_OPERACION))
+def test_propiedades_operacion(nombre):
+    parametros = ESCENARIOS_OPERACION[nombre]
+    coste_desarrollo = calcular_costes_desarrollo()["coste_total"]
+    df_operacion = calcular_costes_operacion_simulacion(**parametros)
+    df_roi, _ = calcular_roi(df_operacion, coste_desarrollo, **PRECIOS_REFERENCIA)
+    assert verificar_propiedades_operacion(df_operacion, df_roi, coste_desarrollo) == []
+    assert verificar_motor_lote(df_operacion, parametros) == []
+
+
+@pytest.mark.parametrize("caso", range(NUM_CASOS_ALEATORIOS))
+def test_propiedades_aleatorias(caso):
+    desarrollo, parametros, precios = generar_caso_aleatorio(caso)
+    df_operacion = calcular_costes_operacion_simulacion(semilla=caso, **parametros)
+    df_roi, _ = calcular_roi(df_operacion, desarrollo["coste_total"], **precios)
+
+    assert verificar_propiedades_desarrollo(desarrollo) == []
+    assert verificar_propiedades_operacion(df_operacion, df_roi, desarrollo["coste_total"]) == []
+    assert verificar_motor_lote(df_operacion, parametros) == []
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["regenerar"]:
+        guardar_resultados_referencia()
+        print(f"Referencia guardada en {RUTA_REFERENCIA}")
+    else:
+        sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,80 @@
+"""
+Tarifas por tramos graduales: importes exactos en los límites de cada tramo,
+justo por encima, por encima del último tramo y con uso negativo, y
+equivalencia del cálculo vectorizado con un bucle escalar.
+"""
+import numpy as np
+import pytest
+
+from calc import TARIFA_APIS, TARIFAS_CHATBOT, coste_por_tramos
+
+TARIFAS = {"chatbot_plan1": TARIFAS_CHATBOT["plan1"], "chatbot_plan2": TARIFAS_CHATBOT["plan2"], "apis": TARIFA_APIS}
+
+
+def coste_por_tramos_bucle(uso, tarifa):
+    """Implementación directa, tramo a tramo, para contrastar la vectorizada."""
+    coste = tarifa["cuota"]
+    limites = list(tarifa["limites"]) + [np.inf]
+    for inicio, fin, precio in zip(limites[:-1], limites[1:], tarifa["precios"]):
+        if uso > inicio:
+            coste += (min(uso, fin) - inicio) * precio
+    return coste
+
+
+@pytest.mark.parametrize("uso, esperado", [
+    (0, 425.51),
+    (20000, 425.51),
+    (20001, 425.51 + 0.02),
+    (100000, 425.51 + 80000 * 0.02),
+    (100001, 425.51 + 80000 * 0.02 + 0.015),
+    (150000, 425.51 + 80000 * 0.02 + 50000 * 0.015)
+])
+def test_chatbot_plan1_en_los_limites(uso, esperado):
+    assert coste_por_tramos(uso, TARIFAS_CHATBOT["plan1"]) == pytest.approx(esperado, rel=1e-12)
+
+
+@pytest.mark.parametrize("uso, esperado", [
+    (5000, 0.0),
+    (5001, 0.011),
+    (50000, 45000 * 0.011),
+    (50001, 45000 * 0.011 + 0.009),
+    (250000, 45000 * 0.011 + 200000 * 0.009),
+    (250001, 45000 * 0.011 + 200000 * 0.009 + 0.0055),
+    (1000000, 45000 * 0.011 + 200000 * 0.009 + 750000 * 0.0055)
+])
+def test_apis_en_los_limites(uso, esperado):
+    assert coste_por_tramos(uso, TARIFA_APIS) == pytest.approx(esperado, rel=1e-12, abs=1e-12)
+
+
+@pytest.mark.parametrize("nombre", list(TARIFAS))
+def test_uso_negativo_cuesta_la_cuota(nombre):
+    tarifa = TARIFAS[nombre]
+    assert coste_por_tramos(-1, tarifa) == tarifa["cuota"]
+    assert coste_por_tramos(-1e9, tarifa) == tarifa["cuota"]
+
+
+@pytest.mark.parametrize("nombre", list(TARIFAS))
+def test_cada_limite_y_una_peticion_mas(nombre):
+    tarifa = TARIFAS[nombre]
+    for limite, precio in zip(tarifa["limites"], tarifa["precios"]):
+        en_limite = coste_por_tramos(limite, tarifa)
+        assert en_limite == pytest.approx(coste_por_tramos_bucle(limite, tarifa), rel=1e-12)
+        # Una petición más se cobra al precio del tramo que empieza en el límite
+        assert coste_por_tramos(limite + 1, tarifa) - en_limite == pytest.approx(precio, abs=1e-9)
+
+
+@pytest.mark.parametrize("nombre", list(TARIFAS))
+def test_array_escenarios_por_meses_coincide_con_bucle(nombre):
+    tarifa = TARIFAS[nombre]
+    rng = np.random.default_rng(0)
+    uso = rng.uniform(-1000, 1.5 * tarifa["limites"][-1], (50, 24))
+    # Incluye los límites exactos y sus vecinos
+    uso[0, :3 * len(tarifa["limites"])] = np.concatenate(
+        [np.asarray(tarifa["limites"], dtype=float) + delta for delta in (-1, 0, 1)]
+    )
+
+    coste = coste_por_tramos(uso, tarifa)
+    assert coste.shape == uso.shape
+    esperado = np.array([[coste_por_tramos_bucle(u, tarifa) for u in fila] for fila in uso])
+    np.testing.assert_allclose(coste, esperado, rtol=1e-12)
+    assert isinstance(coste_por_tramos(float(uso[1, 1]), tarifa), float)